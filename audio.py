@@ -0,0 +1,92 @@
+"""
+Sound effects and music.
+
+The mixer is started once, with a short buffer so effects are heard as
+points are hit. Effects are decoded once into a bank, shared through the
+AssetManager, and played on a pool of reserved channels, and music is
+streamed from disk rather than decoded up front.
+"""
+import os, random
+
+import pygame
+
+try:
+    import android
+except ImportError:
+    android = None
+
+if android:
+    import android_mixer as mixer
+else:
+    from pygame import mixer
+
+FREQUENCY = 44100
+BUFFER = 512
+
+def pre_init():
+    """
+    Sets up the mixer. Has to be called before pygame.init
+    """
+    if not android:
+        mixer.pre_init(FREQUENCY, -16, 2, BUFFER)
+
+class SoundBank():
+    """
+    The game's sound effects, played on `voices` reserved channels. When
+    they are all busy, the one that started playing first is cut off.
+    """
+    directory = "data"
+    effects = ("exp1", "exp2", "exp3", "exp4", "bad1", "bad2")
+    voices = 8
+
+    def __init__(self):
+        self.sounds = {}
+        self.channels = []
+        self.started = []
+        # Picks between variations of an effect. It is kept apart from the
+        # level's generator so sounds can never change how a game plays.
+        self.random = random.Random()
+        try:
+            if not mixer.get_init():
+                mixer.init()
+            for name in self.effects:
+                self.sounds[name] = mixer.Sound(self.path(name))
+        except pygame.error:
+            # No audio device or missing data, so stay silent
+            self.enabled = False
+            return
+        self.enabled = True
+
+        if mixer.get_num_channels() < self.voices:
+            mixer.set_num_channels(self.voices)
+        mixer.set_reserved(self.voices)
+        self.channels = [mixer.Channel(i) for i in range(self.voices)]
+        self.started = [0] * self.voices
+
+    def path(self, name):
+        return os.path.join(self.directory, "{0}.ogg".format(name))
+
+    def play(self, *names):
+        """
+        Plays one of the named effects, picked at random
+        """
+        if not self.enabled:
+            return
+        sound = self.sounds[self.random.choice(names)]
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                break
+        else:
+            i = self.started.index(min(self.started))
+        self.channels[i].play(sound)
+        self.started[i] = pygame.time.get_ticks()
+
+    def play_music(self, name):
+        if self.enabled:
+            mixer.music.load(self.path(name))
+            mixer.music.play()
+
+    def fadeout(self, time):
+        if self.enabled:
+            mixer.fadeout(time)
+            mixer.music.fadeout(time)
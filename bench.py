@@ -0,0 +1,163 @@
+#!/usr/bin/python2
+"""
+Headless benchmarks of level generation and the frame loop.
+
+Every difficulty is run in its own process under SDL's dummy video and
+audio drivers, with a fixed seed, and the results written as JSON. Pass an
+earlier results file with --compare to see what got slower.
+"""
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse, json, multiprocessing, resource, sys, time
+
+import numpy
+import pygame
+from pygame import display
+
+# The game loads its data relative to the working directory
+CWD = os.getcwd()
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+import me, sim
+
+STAGES = ("generation", "pre_draw", "prerender", "update", "draw",
+          "present")
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[int(round(p / 100. * (len(samples) - 1)))]
+
+def summarise(samples):
+    return {
+        'total': sum(samples),
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+        }
+
+def run(difficulty, frames, seed):
+    """
+    Prepares a level and runs up to `frames` frames of it, returning the
+    timings of each stage in seconds.
+    """
+    numpy.random.seed(seed)
+    display.set_mode((me.VWIDTH, me.VHEIGHT), 0, 32)
+    screen = me.Screen(pygame.time.Clock(), difficulty, seed)
+    spiral = screen.spiral
+    logic = screen.logic
+    samples = dict((stage, []) for stage in STAGES)
+
+    def timed(stage, func, *args):
+        start = time.time()
+        func(*args)
+        samples[stage].append(time.time() - start)
+
+    timed("pre_draw", spiral.pre_draw)
+    timed("generation", spiral.generate_paths)
+    timed("pre_draw", spiral.pre_draw_paths)
+    timed("pre_draw", spiral.index_points)
+    timed("prerender", spiral.prerender)
+    logic.change_color(0)
+
+    surface = display.get_surface()
+    frame_times = []
+    pixels = []
+    while logic.running and len(frame_times) < frames:
+        pygame.event.pump()
+        start = time.time()
+        timed("update", screen.step, 1. / me.FPS)
+        draw_start = time.time()
+        rects = screen.draw(surface)
+        samples["draw"].append(time.time() - draw_start)
+        if rects is None:
+            timed("present", display.flip)
+            pixels.append(me.VWIDTH * me.VHEIGHT)
+        else:
+            timed("present", display.update, rects)
+            pixels.append(sum(rect.width * rect.height for rect in rects))
+        frame_times.append(time.time() - start)
+
+    result = {
+        'frames': len(frame_times),
+        'paths': sum(len(paths) for paths in spiral.paths_by_dev.values()),
+        'stages': dict((stage, summarise(times))
+                       for stage, times in samples.items() if times),
+        'frame': summarise(frame_times),
+        'pixels': summarise(pixels),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'assets': screen.assets.stats(),
+        }
+    return result
+
+def run_isolated(difficulty, frames, seed):
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run, (difficulty, frames, seed))
+    finally:
+        pool.close()
+        pool.join()
+
+def compare(results, baseline, threshold):
+    """
+    Prints how each timing changed against the baseline results, returning
+    the number that got slower by more than `threshold`.
+    """
+    regressions = 0
+    for difficulty, result in sorted(results['results'].items()):
+        old = baseline['results'].get(difficulty)
+        if not old:
+            continue
+        rows = [("frame " + p, result['frame'][p], old['frame'][p])
+                for p in ("p50", "p95", "p99")]
+        rows += [(stage + " total", result['stages'][stage]['total'],
+                  old['stages'][stage]['total'])
+                 for stage in sorted(result['stages'])
+                 if stage in old['stages']]
+        rows.append(("peak rss", result['peak_rss_kb'], old['peak_rss_kb']))
+        print difficulty
+        for name, new, before in rows:
+            change = (new - before) / float(before) if before else 0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print "  {0:20} {1:12.4f} {2:12.4f} {3:+7.1%}{4}".format(
+                name, before, new, change, flag)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("difficulties", nargs="*",
+                        default=sorted(sim.path_counts))
+    parser.add_argument("-f", "--frames", type=int, default=600)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="bench.json")
+    parser.add_argument("-c", "--compare",
+                        help="earlier results to compare against")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1,
+                        help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = {'seed': args.seed, 'frames': args.frames, 'results': {}}
+    for difficulty in args.difficulties:
+        result = run_isolated(difficulty, args.frames, args.seed)
+        results['results'][difficulty] = result
+        print "{0}: {1} paths, {2} frames, p50 {3:.2f}ms p95 {4:.2f}ms " \
+            "p99 {5:.2f}ms, peak {6}MB".format(
+            difficulty, result['paths'], result['frames'],
+            result['frame']['p50'] * 1000, result['frame']['p95'] * 1000,
+            result['frame']['p99'] * 1000, result['peak_rss_kb'] / 1024)
+
+    with open(os.path.join(CWD, args.output), "w") as output:
+        output.write(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(os.path.join(CWD, args.compare)) as baseline:
+            if compare(results, json.loads(baseline.read()), args.threshold):
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
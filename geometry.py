@@ -0,0 +1,96 @@
+"""
+The spiral's deviation lines, sampled with NumPy.
+
+The spiral r = const * t is sampled about `interval` pixels apart along its
+length. Stepping t by interval / r each time makes t**2 grow by about
+2 * interval / const per step, so every sample can be computed at once
+instead of walking the spiral one step at a time. The deviation lines share
+those samples, only their radii are offset.
+"""
+from math import pi
+
+import numpy
+
+DEVS = (-2, -1, 0, 1, 2)
+
+def sample(init, end, interval, const):
+    """
+    The values of t from just after init to just past end at which the
+    spiral is sampled
+    """
+    step = 2. * interval / const
+    count = int(numpy.ceil((end ** 2 - init ** 2) / step))
+    return numpy.sqrt(init ** 2 + step * numpy.arange(1, count + 1))
+
+def cartesian(t, dev, const, center):
+    """
+    The points at each t along a deviation line as a (len(t), 2) array
+    """
+    r = const * (t + dev * pi / 4)
+    return numpy.column_stack((r * numpy.cos(t) + center[0],
+                               r * numpy.sin(t) + center[1]))
+
+class Geometry():
+    def __init__(self, init, end, interval, const, center):
+        self.const = const
+        self.center = center
+        self.t = sample(init, end, interval, const)
+
+        devs = numpy.array(DEVS)[:, None]
+        r = const * (self.t + devs * pi / 4)
+        x = r * numpy.cos(self.t) + center[0]
+        y = r * numpy.sin(self.t) + center[1]
+        # A (len(t), 2) array of points per deviation
+        self.lines = dict(zip(DEVS, numpy.dstack((x, y))))
+
+    def polyline(self, start, end, dev):
+        """
+        The part of a deviation line between start and end: the samples in
+        between, sliced out of the line, and the exact ends.
+        """
+        i, j = numpy.searchsorted(self.t, (start, end))
+        ends = cartesian(numpy.array((start, end)), dev,
+                         self.const, self.center)
+        return numpy.concatenate((ends[:1], self.lines[dev][i:j], ends[1:]))
+
+def bucket(points, size, columns, rows):
+    """
+    Sorts the segments of a polyline into the tiles of a columns x rows grid
+    of `size` pixel tiles they touch. Returns a dict of (tx, ty) to the runs
+    of consecutive segments in that tile, each as an array of points.
+    """
+    if len(points) < 2:
+        return {}
+    a, b = points[:-1], points[1:]
+    low = numpy.maximum(numpy.floor(numpy.minimum(a, b) / size), 0)
+    high = numpy.minimum(numpy.floor(numpy.maximum(a, b) / size),
+                         (columns - 1, rows - 1))
+    low, high = low.astype(int), high.astype(int)
+
+    # Segments are short next to tiles, so each only reaches a tile or two
+    # past its first in either direction
+    index = numpy.arange(len(a))
+    segments, tiles = [], []
+    span = (high - low).max(axis=0)
+    for dx in xrange(max(span[0], 0) + 1):
+        for dy in xrange(max(span[1], 0) + 1):
+            tx, ty = low[:, 0] + dx, low[:, 1] + dy
+            inside = (tx <= high[:, 0]) & (ty <= high[:, 1])
+            segments.append(index[inside])
+            tiles.append((ty * columns + tx)[inside])
+    segments = numpy.concatenate(segments)
+    tiles = numpy.concatenate(tiles)
+    if not len(tiles):
+        return {}
+    order = numpy.lexsort((segments, tiles))
+    segments, tiles = segments[order], tiles[order]
+
+    # A run ends wherever the tile changes or a segment is skipped
+    breaks = numpy.flatnonzero((numpy.diff(tiles) != 0) |
+                               (numpy.diff(segments) != 1)) + 1
+    runs = {}
+    for first, last in zip(numpy.r_[0, breaks], numpy.r_[breaks, len(tiles)]):
+        tile = int(tiles[first])
+        runs.setdefault((tile % columns, tile // columns), []).append(
+            points[segments[first]:segments[last - 1] + 2])
+    return runs
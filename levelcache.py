@@ -0,0 +1,255 @@
+"""
+An on-disk cache of generated levels and their rendered background tiles.
+
+Levels are cached under their difficulty, seed and everything else that
+changes how they are generated or drawn. On a warm start the paths and
+points are read back from compact arrays and background tiles are read out
+of a memory mapped file as they are needed, rather than being generated
+and rendered again. Only the most recently used levels are kept.
+"""
+import array, hashlib, mmap, os, struct, sys, threading, zlib
+
+import sim
+
+try:
+    import android
+except ImportError:
+    android = None
+
+MAGIC = "MELV"
+# Also part of every key, so bumped whenever tiles are drawn differently
+VERSION = 2
+# Number of levels kept in the cache
+KEEP = 16
+
+HEADER = struct.Struct("<4sBII")
+TILE = struct.Struct("<hhI")
+
+# The columns of a level file, after the header. The first five have an
+# entry per path and the last two an entry per point.
+PATH_COLUMNS = (("start", "d"), ("end", "d"), ("dev", "b"), ("color", "B"),
+                ("points", "I"))
+POINT_COLUMNS = (("t", "d"), ("unhittable", "B"))
+
+def cache_dir():
+    if android:
+        return "/sdcard/Me/cache"
+    elif sys.platform == "win32":
+        return None
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or
+                        os.path.expanduser("~/.cache"), "me")
+
+def level_key(level, *extra):
+    """
+    The name a level is cached under: its difficulty and seed and a hash of
+    its other parameters and anything in `extra`.
+    """
+    params = (VERSION, level.interval, level.const, level.init, level.max,
+              level.path_count, level.density) + extra
+    digest = hashlib.md5(repr(params)).hexdigest()[:12]
+    return "{0}-{1}-{2}".format(level.difficulty, level.seed, digest)
+
+def open_level(key):
+    """
+    The LevelCache for the given key, or None if there is nowhere to cache
+    levels.
+    """
+    directory = cache_dir()
+    if directory is None:
+        return None
+    try:
+        os.makedirs(directory)
+    except OSError:
+        pass
+    if not os.path.isdir(directory):
+        return None
+    return LevelCache(directory, key)
+
+def prune(directory, keep=KEEP):
+    """
+    Deletes all but the `keep` most recently used levels in the directory
+    """
+    def used(name):
+        try:
+            return os.path.getmtime(os.path.join(directory, name + ".level"))
+        except OSError:
+            return 0
+
+    names = set(name.rsplit(".", 1)[0] for name in os.listdir(directory)
+                if name.endswith((".level", ".tiles")))
+    for name in sorted(names, key=used, reverse=True)[keep:]:
+        for ext in (".level", ".tiles"):
+            try:
+                os.remove(os.path.join(directory, name + ext))
+            except OSError:
+                pass
+
+class LevelCache():
+    """
+    The cached files of a single level: `<key>.level` holding its paths and
+    points, and `<key>.tiles` holding its background tiles.
+    """
+    def __init__(self, directory, key):
+        self.directory = directory
+        self.filename = os.path.join(directory, key + ".level")
+        self.tiles = TileStore(os.path.join(directory, key + ".tiles"))
+
+    def load(self, level):
+        """
+        Fills the level with the cached paths. Returns whether there were
+        any to load.
+        """
+        try:
+            columns = read_columns(self.filename)
+            os.utime(self.filename, None)
+        except (EnvironmentError, ValueError, struct.error):
+            return False
+
+        points = iter(zip(columns["t"], columns["unhittable"]))
+        for start, end, dev, color, count in zip(
+                *[columns[name] for name, _ in PATH_COLUMNS]):
+            path = sim.Path(level, start, end, level.colors[color], dev)
+            for _ in xrange(count):
+                t, unhittable = next(points)
+                path.add_point(t, unhittable)
+            level.insert_path(path)
+        return True
+
+    def save(self, level):
+        """
+        Caches the level's paths, then drops the least recently used levels
+        """
+        columns = dict((name, array.array(typecode))
+                       for name, typecode in PATH_COLUMNS + POINT_COLUMNS)
+        points = level.points
+        for paths in level.paths_by_color.values():
+            for path in paths:
+                columns["start"].append(path.start)
+                columns["end"].append(path.end)
+                columns["dev"].append(path.dev)
+                columns["color"].append(level.colors.index(path.color))
+                columns["points"].append(path.last - path.first)
+                columns["t"].extend(points.t[path.first:path.last])
+                columns["unhittable"].extend(
+                    bool(flags & sim.Points.UNHITTABLE)
+                    for flags in points.flags[path.first:path.last])
+
+        temp = self.filename + ".tmp"
+        try:
+            with open(temp, "wb") as level_file:
+                level_file.write(HEADER.pack(MAGIC, VERSION,
+                                             len(columns["start"]),
+                                             len(columns["t"])))
+                for name, _ in PATH_COLUMNS + POINT_COLUMNS:
+                    columns[name].tofile(level_file)
+            os.rename(temp, self.filename)
+        except EnvironmentError:
+            return
+        prune(self.directory)
+
+def read_columns(filename):
+    """
+    Reads the columns of a level file through a memory map
+    """
+    with open(filename, "rb") as level_file:
+        data = mmap.mmap(level_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, paths, points = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a version {0} level".format(VERSION))
+        columns = {}
+        offset = HEADER.size
+        for names, count in ((PATH_COLUMNS, paths), (POINT_COLUMNS, points)):
+            for name, typecode in names:
+                column = columns[name] = array.array(typecode)
+                end = offset + column.itemsize * count
+                if end > len(data):
+                    raise ValueError("Truncated level")
+                column.fromstring(data[offset:end])
+                offset = end
+        if sum(columns["points"]) != points:
+            raise ValueError("Corrupt level")
+        return columns
+    finally:
+        data.close()
+
+class TileStore():
+    """
+    The background tiles of a level. Tiles are appended to the file as they
+    are first rendered, each as a (tx, ty, length) header followed by its
+    zlib compressed pixels. When opened the file is memory mapped and
+    indexed by its headers, so a tile is only read when it is needed.
+    """
+    def __init__(self, filename):
+        self.index = {}
+        self.fresh = {}
+        self.data = ""
+        self.lock = threading.Lock()
+        try:
+            with open(filename, "rb") as tile_file:
+                self.data = mmap.mmap(tile_file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            pass
+        end = self.scan()
+
+        try:
+            self.output = open(filename, "ab")
+            if end < len(self.data):
+                # Drop a tile that was cut short, or the ones after it would
+                # be lost too
+                self.output.truncate(end)
+        except IOError:
+            self.output = None
+
+    def scan(self):
+        """
+        Indexes the tiles in the file, returning where the last whole one
+        ends
+        """
+        offset = 0
+        while offset + TILE.size <= len(self.data):
+            tx, ty, length = TILE.unpack_from(self.data, offset)
+            start = offset + TILE.size
+            if start + length > len(self.data):
+                break
+            self.index[tx, ty] = (start, length)
+            offset = start + length
+        return offset
+
+    def get(self, tile):
+        """
+        The pixels of the tile, or None if it has not been stored
+        """
+        blob = self.fresh.get(tile)
+        if blob is None:
+            if tile not in self.index:
+                return None
+            start, length = self.index[tile]
+            blob = self.data[start:start + length]
+        try:
+            return zlib.decompress(blob)
+        except zlib.error:
+            return None
+
+    def __contains__(self, tile):
+        return tile in self.index or tile in self.fresh
+
+    def put(self, tile, pixels):
+        if self.output is not None and tile not in self:
+            self.add(tile, zlib.compress(pixels))
+
+    def add(self, tile, blob):
+        """
+        Stores a tile's already compressed pixels
+        """
+        if self.output is None or tile in self:
+            return
+        with self.lock:
+            self.fresh[tile] = blob
+            try:
+                self.output.write(TILE.pack(tile[0], tile[1], len(blob)) +
+                                  blob)
+                self.output.flush()
+            except IOError:
+                self.output = None
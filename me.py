@@ -2,12 +2,16 @@
 RELEASE = False
 
 from math import pi, cos, sin, hypot
-from datetime import datetime
-import random, os, sys, json
+from collections import OrderedDict
+import os, sys, json, threading, multiprocessing, signal, time, zlib
 
+import numpy
 import pygame
 from pygame import draw, display, image, key, font, transform, mouse
 
+import audio
+
+audio.pre_init()
 pygame.init()
 #mouse.set_visible(False)
 key.set_repeat(10, 75)
@@ -18,6 +22,12 @@ except ImportError:
     android = None
 
 import particles
+import sim
+import replay
+import levelcache
+import geometry
+import profiling
+from sim import TURNS, STEP
 
 if RELEASE:
     modes = display.list_modes()
@@ -26,7 +36,20 @@ else:
     VWIDTH, VHEIGHT = 1080, 960
 
 FPS = 60
-TURNS = 10
+# The game is moved on in fixed steps of sim.STEP seconds whatever the frame
+# rate, catching up on at most MAX_FRAME_TIME seconds after a slow frame
+MAX_FRAME_TIME = 0.25
+# Once the game has started, the rest of the level is prepared for up to this
+# many seconds a frame
+PREPARE_TIME = 0.004
+# Backgrounds are rendered lazily in square tiles of this many pixels, keeping
+# at most TILE_BUDGET bytes of them around.
+TILE_SIZE = 256
+TILE_BUDGET = 32 * 1024 * 1024
+# Tiles are 8 bit and share one layout of palette entries between all colour
+# schemes: AA_SHADES shades blending the background into the border colour,
+# then one entry per path colour.
+AA_SHADES = 16
 
 color_schemes = ["blue", "red", "green", "yellow"]
 COLOR_SPARKS = map(pygame.Color, ["#E6E6AC", "#777278", "#A9A990"])
@@ -83,31 +106,13 @@ colors = {
         }
 }
 
-path_counts = {
-    'easy': 100,
-    'medium': 500,
-    'hard': 1000
-}
-
-avatar_speeds = {
-    'easy': 150,
-    'medium': 200,
-    'hard': 300
-}
-
-def randrange(start, end):
-    """
-    Return a random variable between start and end. Will be a float
-
-    Arguments:
-    - `start`:
-    - `end`:
-    """
-    return random.randrange(int(start*10000), int(end*10000))/10000.
-
-def gc(color, cc=None):
-    current = cc
-    return from_hex(colors[current][color])
+color_roles = ["background", "spiral_color", "border_color", "pale",
+               "avatar", "p1", "p2", "p3", "p4"]
+# Indices of the schemes and roles in color_table
+BLUE, RED, GREEN, YELLOW = range(len(color_schemes))
+BACKGROUND, SPIRAL_COLOR, BORDER_COLOR, PALE, AVATAR, P1, P2, P3, P4 = \
+    range(len(color_roles))
+scheme_ids = dict((scheme, i) for i, scheme in enumerate(color_schemes))
 
 def from_hex(value):
     if isinstance(value, str):
@@ -116,6 +121,12 @@ def from_hex(value):
         return tuple(int(value[i:i+lv/3], 16) for i in range(0, lv, lv/3))
     return value
 
+# Every colour of every scheme as an RGB tuple, indexed by scheme and then
+# role, so nothing is parsed while drawing
+color_table = tuple(tuple(from_hex(colors[scheme][role])
+                          for role in color_roles)
+                    for scheme in color_schemes)
+
 def format_score(score):
     rvst = str(int(score))[::-1]
     return ','.join(rvst[i:i+3] for i in\
@@ -126,28 +137,43 @@ def to_cartesian(t, r, o=(0, 0), force_int=False):
         return int(r * cos(t) + o[0]), int(r * sin(t) + o[1])
     return r * cos(t) + o[0], r * sin(t) + o[1]
 
-class Logic():
-    bonus_decay = 0.7
-    bonus_increase = 10
-    color_difficulties = {
-        'easy': ['blue', 'red'],
-        'medium': ['blue', 'red', 'green'],
-        'hard': ['blue', 'red', 'green', 'yellow']
-        }
+# The spiral being prerendered and the shared pixels it is rendered into,
+# inherited by the processes rendering it
+prerendering = None
+
+def reset_signals():
+    """
+    Run in each prerendering process. They are forked after pygame.init and
+    so inherit SDL's handlers for SIGTERM and SIGINT, which would swallow
+    the SIGTERM that stops them when the pool is terminated.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+def prerender_tile((slot, tx, ty)):
+    """
+    Renders a tile of the spiral being prerendered into its slot of the
+    shared pixels. Returns the slot and, if the spiral is cached, the
+    compressed pixels to store.
+    """
+    spiral, pixels = prerendering
+    data = image.tostring(spiral.render_tile(tx, ty), "P")
+    pixels[slot * len(data):(slot + 1) * len(data)] = numpy.frombuffer(
+        data, numpy.uint8)
+    return slot, spiral.cache and zlib.compress(data)
+
+class Logic(sim.Game):
     exit_keys = (pygame.K_ESCAPE,)
     down_keys = (pygame.K_DOWN,)
     up_keys = (pygame.K_UP,)
+    profiler_keys = (pygame.K_F3,)
 
-    def __init__(self, screen, difficulty):
-        self.last_updated = 0
-        self.difficulty = difficulty
-        self.current_color = "blue"
+    def __init__(self, screen, difficulty, seed=None):
+        sim.Game.__init__(self, difficulty, seed)
         self.screen = screen
-        self.running = True
-        self.bonus = 0
-        self.score = 0
 
     def create_spiral_dependants(self):
+        self.level = self.screen.spiral
         self.avatar = Avatar(self, self.screen)
         self.particles = ParticleManager(self, self.screen)
         self.hud = HUD(self.screen, self)
@@ -159,9 +185,11 @@ class Logic():
             if event.key in self.exit_keys:
                 self.running = False
             elif event.key in self.down_keys:
-                self.avatar.change_dev(-1)
+                self.change_dev(-1)
             elif event.key in self.up_keys:
-                self.avatar.change_dev(1)
+                self.change_dev(1)
+            elif event.key in self.profiler_keys:
+                self.screen.toggle_profiler()
             elif event.key in color_keymap:
                 color = color_keymap[event.key]
                 if color in self.colors:
@@ -186,237 +214,433 @@ class Logic():
                  pos[1] + s_pos[1] - s_center[1])
         mag = hypot(*s_pos)
         if abs(mag) > abs(self.screen.spiral.radius(self.avatar.t)):
-            self.avatar.change_dev(1)
-        else:
-            self.avatar.change_dev(-1)
-
-    def update(self):
-        """
-        Updates the various objects. Namely:
-         - Bonus decay
-
-        """
-        now = datetime.utcnow()
-        if not self.last_updated:
-            self.last_updated = now
-        t_delta = (now - self.last_updated).total_seconds() or 0.000001
-        if not self.avatar.on_path():
-            self.bonus -= self.bonus_decay * self.bonus * t_delta
-            if self.bonus < 1:
-                self.bonus = 0
+            self.change_dev(1)
         else:
-            self.bonus += self.bonus_increase * t_delta
-        self.last_updated = now
+            self.change_dev(-1)
 
-        oldt = self.avatar.t
-
-        self.avatar.update(t_delta)
-
-        if self.avatar.on_any_path():
-            path = self.avatar.get_on_path()
-            point = path.passed(oldt, self.avatar.t)
-            if point:
-                if not point.unhittable:
-                    point.hit = True
-                if self.correct_point(point):
-                    self.correct_point_hit()
-                elif not self.avatar.bouncing:
-                    self.incorrect_point_hit()
-
-        self.particles.update(t_delta)
-
-    def correct_point(self, point):
-        return point.color == self.current_color
-
-    @property
-    def colors(self):
-        return self.color_difficulties[self.difficulty]
+    def point_passed(self, point):
+        sim.Game.point_passed(self, point)
+        self.screen.compositor.invalidate(self.level.point_area(point))
 
     def change_color(self, index):
-        self.current_color = self.colors[index]
+        sim.Game.change_color(self, index)
+        self.screen.spiral.set_palette(self.current_color)
+        self.screen.compositor.invalidate()
 
     def correct_point_hit(self):
-        self.score += self.bonus * 1000
-        self.bonus += 10
-
+        sim.Game.correct_point_hit(self)
         self.particles.correct_point_hit()
-        self.avatar.correct_point_hit()
+        self.screen.play_sound("exp1", "exp2", "exp3", "exp4")
 
     def incorrect_point_hit(self):
-        self.score /= 5
-        self.bonus = 0
-
+        sim.Game.incorrect_point_hit(self)
         self.particles.incorrect_point_hit()
-        self.avatar.incorrect_point_hit()
+        self.screen.play_sound("bad1", "bad2")
 
     def game_ended(self):
         return
 
-class Spiral():
+class Spiral(sim.Level):
     def __init__(self, width, height, colors,
                  screen, logic,
                  sample_interval=10, const=30,
-                 init=1.0, max=2*pi*TURNS):
+                 init=1.0, max=2*pi*TURNS,
+                 path_count=None, density=None):
+        sim.Level.__init__(self, logic.difficulty, logic.seed,
+                           sample_interval, const, init, max,
+                           path_count, density)
         self.screen = screen
         self.logic = logic
 
         self.width, self.height = width, height
         self.center = (width/2, height/2)
-        self.interval = sample_interval
-        self.const = const
-        self.init = init
-        self.max = max
         self.colors = colors
-        self.paths_by_color = {}
-        for color in self.logic.colors:
-            self.paths_by_color[color] = []
-        self.paths_by_dev = {-2: [], -1: [], 0: [], 1: [], 2: []}
 
-        self.spirals = {}
+        self.geometry = geometry.Geometry(init, max, sample_interval, const,
+                                          self.center)
+        self.tiles = TileCache(self)
+        # Laid out when the first tile has to be rendered, see render_tile
+        self.tile_lines = None
+        self.tile_paths = None
+        # Where each of the level's points is, see index_points
+        self.point_x = self.point_y = numpy.zeros(0)
+        self.tile_points = {}
+        self.cache = None
+        # Whether the background around the start has been rendered
+        self.ready = False
+        self.polylines = {}
+        self.palettes = {}
+        self.palette = self.get_palette(self.logic.current_color)
 
     def prepare(self):
-        self.pre_draw()
-        self.generate_paths()
-        self.pre_draw_paths()
+        for _ in self.preparing():
+            pass
+
+    def preparing(self):
+        """
+        Prepares the level a step at a time, yielding how far along it is,
+        from 0 to 1, after each step.
+
+        The level is loaded from the cache, or generated and cached, and its
+        points sorted into tiles. Then the background is prerendered, see
+        prerender_steps.
+        """
+        self.cache = levelcache.open_level(levelcache.level_key(
+                self, self.width, self.height, self.tiles.size, bool(android)))
+        if not (self.cache and self.cache.load(self)):
+            self.generate_paths()
+            if self.cache:
+                self.cache.save(self)
+        self.index_points()
+        yield 0.
+        for progress in self.prerender_steps():
+            yield progress
+
+    def prerender(self, processes=None):
+        for _ in self.prerender_steps(processes):
+            pass
+
+    def prerender_steps(self, processes=None):
+        """
+        Renders every background tile that is not cached yet, nearest the
+        centre first, so none has to be rendered while playing. Yields the
+        fraction of tiles done after each one, and sets `ready` once every
+        tile within a screen of the start is.
+
+        Tiles are rendered by a pool of `processes` processes, one per core
+        unless told otherwise, which write the pixels into shared memory.
+        The workers inherit the spiral by forking, so on android, with a
+        single core or where processes are spawned rather than forked, e.g.
+        on win32, they are rendered here instead.
+        """
+        size = self.tiles.size
+        cx, cy = (self.center[0] - size / 2.) / size, \
+            (self.center[1] - size / 2.) / size
+        todo = [tile for tile in self.tiles.covering(0, 0, self.width - 1,
+                                                     self.height - 1)
+                if tile not in self.tiles.tiles and
+                not (self.cache and tile in self.cache.tiles)]
+        todo.sort(key=lambda (tx, ty): hypot(tx - cx, ty - cy))
+
+        x, y = self.screen.to_cart(self.init)
+        waiting = set(todo).intersection(self.tiles.covering(
+                x - VWIDTH, y - VHEIGHT, x + VWIDTH, y + VHEIGHT))
+        self.ready = not waiting
+        if not todo:
+            return
+        if self.tile_lines is None:
+            self.pre_draw()
+            self.pre_draw_paths()
+
+        processes = processes or multiprocessing.cpu_count()
+        if android or processes < 2 or not hasattr(os, "fork"):
+            for done, (tx, ty) in enumerate(todo):
+                self.tiles.get(tx, ty)
+                waiting.discard((tx, ty))
+                self.ready = not waiting
+                yield (done + 1.) / len(todo)
+            return
+
+        global prerendering
+        shared = multiprocessing.RawArray('B', len(todo) * size * size)
+        pixels = numpy.frombuffer(shared, numpy.uint8)
+        prerendering = self, pixels
+        pool = multiprocessing.Pool(processes, reset_signals)
+        try:
+            jobs = [(slot, tx, ty) for slot, (tx, ty) in enumerate(todo)]
+            for done, (slot, blob) in enumerate(pool.imap_unordered(
+                    prerender_tile, jobs, chunksize=4)):
+                tx, ty = todo[slot]
+                # It may have been needed, and rendered, before it came back
+                if (tx, ty) not in self.tiles.tiles:
+                    # The tile is the slot itself rather than a copy, which
+                    # keeps all of the shared pixels for as long as any of
+                    # their tiles is cached
+                    tile = image.frombuffer(
+                        pixels[slot * size * size:(slot + 1) * size * size],
+                        (size, size), "P")
+                    tile.set_palette(self.palette)
+                    self.tiles.add(tx, ty, tile)
+                if blob:
+                    self.cache.tiles.add((tx, ty), blob)
+                waiting.discard((tx, ty))
+                self.ready = not waiting
+                yield (done + 1.) / len(todo)
+        finally:
+            # Stops the pool straight away if the game ended first
+            pool.terminate()
+            pool.join()
+            prerendering = None
 
     def pre_draw(self):
-        self.spirals = {}
-        for color in self.colors:
-            surf = pygame.Surface((self.width, self.height), pygame.HWSURFACE)
-            deviations = [pi/4 * x for x in range(-2, 3)]
-            deviationlines = [[] for x in range(-2, 3)]
-            t = self.init
-            while t < self.max:
-                t += self.interval/self.radius(t)
-                for i, dev in enumerate(deviations):
-                    deviationlines[i].append(
-                        to_cartesian(t, self.radius(t + dev),
-                                     o=self.center))
-
-            surf.fill(gc('background', color))
-            for dev, dpoints in zip(deviations, deviationlines):
-                if android:
-                    func = draw.lines
-                else:
-                    func = draw.aalines
-                func(surf, self.screen.gc("border_color"), False, dpoints)
-            self.spirals[color]  = surf
-
-    def generate_paths(self):
-        count = path_counts[self.logic.difficulty]
-        paths = []
-        for _ in range(count):
-            color = random.choice(self.logic.colors)
-            dev = random.randrange(-2, 3)
-            s = randrange(self.init + pi, self.max - pi/8)
-            l = randrange(pi/8, pi/4)
-            e = s + l
-            if e > self.max:
-                e = self.max
-            path = Path(self, s, e, color, dev)
-            if any(o.intersect(path) for o in paths):
-                continue
-
-            path.generate_points(1 + random.random() * 5)
-            self.paths_by_color[color].append(path)
-            self.paths_by_dev[dev].append(path)
-            paths.append(path)
+        """
+        Sorts the segments of the spiral's deviation lines into the tiles
+        they cross. Nothing is rendered until a tile is needed.
+        """
+        self.tile_lines = {}
+        for dev in geometry.DEVS:
+            runs = geometry.bucket(self.geometry.lines[dev], self.tiles.size,
+                                   self.tiles.columns, self.tiles.rows)
+            for tile, tile_runs in runs.items():
+                self.tile_lines.setdefault(tile, []).extend(tile_runs)
 
     def pre_draw_paths(self):
+        self.tile_paths = {}
         for paths in self.paths_by_color.values():
             for path in paths:
-                for bg in self.spirals.values():
-                    path.draw(bg)
+                polyline = self.path_polyline(path)
+                left, top = polyline.min(axis=0) - 2
+                right, bottom = polyline.max(axis=0) + 2
+                for tile in self.tiles.covering(left, top, right, bottom):
+                    self.tile_paths.setdefault(tile, []).append(path)
+
+    def path_polyline(self, path):
+        if path not in self.polylines:
+            self.polylines[path] = self.geometry.polyline(path.start,
+                                                          path.end, path.dev)
+        return self.polylines[path]
+
+    def draw_path(self, surface, path, offset=(0, 0), color=None):
+        points = (self.path_polyline(path) - offset).tolist()
+        color = color or color_table[scheme_ids[path.color]][AVATAR]
+        draw.lines(surface, color, False, points, 3)
+
+    def get_palette(self, color):
+        """
+        The tile palette for the given colour scheme
+        """
+        if color not in self.palettes:
+            colors = color_table[scheme_ids[color]]
+            bg, border = colors[BACKGROUND], colors[BORDER_COLOR]
+            shades = AA_SHADES - 1.
+            palette = [tuple(int(b + (e - b) * i / shades)
+                             for b, e in zip(bg, border))
+                       for i in range(AA_SHADES)]
+            palette += [scheme[AVATAR] for scheme in color_table]
+            self.palettes[color] = palette
+        return self.palettes[color]
+
+    def set_palette(self, color):
+        """
+        Recolours every background tile to the given colour scheme
+        """
+        self.palette = self.get_palette(color)
+        for tile in self.tiles.tiles.values():
+            tile.set_palette(self.palette)
 
-    def radius(self, t, dev=0):
-        return self.const * (t + dev * pi/float(4))
+    def load_tile(self, tx, ty):
+        """
+        The background tile at tile coordinates (tx, ty), read from the
+        cache if it has been rendered before
+        """
+        size = self.tiles.size
+        pixels = self.cache and self.cache.tiles.get((tx, ty))
+        if pixels is None:
+            surf = self.render_tile(tx, ty)
+            if self.cache:
+                self.cache.tiles.put((tx, ty), image.tostring(surf, "P"))
+        else:
+            surf = image.fromstring(pixels, (size, size), "P")
+            surf.set_palette(self.palette)
+        return surf
 
-    def get_background(self, surf):
-        pos = self.screen.screen_pos
-        color = self.logic.current_color
-        surf.blit(self.spirals[color], (0, 0),
-                  (pos, (pos[0] + VWIDTH, pos[1] + VHEIGHT)))
+    def render_tile(self, tx, ty):
+        """
+        Renders the background tile at tile coordinates (tx, ty).
 
-    def draw_points(self, surface):
-        for paths in self.paths_by_color.values():
-            for path in paths:
-                for point in path.points:
-                    point.draw(surface)
+        Tiles are drawn with a greyscale ramp standing in for the shades
+        between background and border, so that antialiasing lands on the
+        right palette entries, and are then given the real palette.
+        """
+        if self.tile_lines is None:
+            self.pre_draw()
+            self.pre_draw_paths()
+        size = self.tiles.size
+        offset = (tx * size, ty * size)
+        surf = pygame.Surface((size, size), 0, 8)
+        shades = [(i * 255 / (AA_SHADES - 1),) * 3 for i in range(AA_SHADES)]
+        inks = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 0, 255)]
+        # The unused entries are padded with the background so that no
+        # pixel is ever mapped to one, as they are not recoloured
+        surf.set_palette(shades + inks +
+                         shades[:1] * (256 - len(shades) - len(inks)))
+        surf.fill(shades[0])
+        if android:
+            func = draw.lines
+        else:
+            func = draw.aalines
+        for run in self.tile_lines.get((tx, ty), ()):
+            func(surf, shades[-1], False, (run - offset).tolist())
+        for path in self.tile_paths.get((tx, ty), ()):
+            self.draw_path(surf, path, offset,
+                           inks[color_schemes.index(path.color)])
+        surf.set_palette(self.palette)
+        return surf
+
+    def blit_area(self, surf, area, dest=(0, 0)):
+        """
+        Blits the part of the background inside `area` (in spiral
+        coordinates) onto `surf` at `dest`.
+        """
+        size = self.tiles.size
+        for tx, ty in self.tiles.covering(area.left, area.top,
+                                          area.right - 1, area.bottom - 1):
+            surf.blit(self.tiles.get(tx, ty),
+                      (dest[0] + tx * size - area.left,
+                       dest[1] + ty * size - area.top))
+
+    def render_area(self, area):
+        surf = pygame.Surface(area.size)
+        self.blit_area(surf, area)
+        return surf
+
+    def index_points(self):
+        """
+        Sorts the points into the tiles they lie in, so drawing only has to
+        look at the points near the viewport.
+        """
+        t = numpy.array(self.points.t, float)
+        r = numpy.array(self.points.r, float)
+        self.point_x = r * numpy.cos(t) + self.center[0]
+        self.point_y = r * numpy.sin(t) + self.center[1]
+
+        size, rows = self.tiles.size, self.tiles.rows
+        tx = self.point_x.astype(int) // size
+        ty = self.point_y.astype(int) // size
+        # Points off the grid are never drawn
+        order = numpy.flatnonzero((tx >= 0) & (tx < self.tiles.columns) &
+                                  (ty >= 0) & (ty < rows))
+        tiles = (tx * rows + ty)[order]
+        by_tile = numpy.argsort(tiles, kind="mergesort")
+        order, tiles = order[by_tile], tiles[by_tile]
+        breaks = numpy.flatnonzero(numpy.diff(tiles)) + 1
+        self.tile_points = {}
+        for first, last in zip(numpy.r_[0, breaks],
+                               numpy.r_[breaks, len(tiles)]):
+            tile = int(tiles[first])
+            self.tile_points[tile // rows, tile % rows] = order[first:last]
+
+    point_radius = 10
+    def draw_points(self, surface, area, offset):
+        """
+        Draws the points touching `area` (in spiral coordinates) onto
+        `surface`, whose top left is at `offset` on the spiral.
+        """
+        radius = self.point_radius
+        area = area.inflate(radius * 2 + 2, radius * 2 + 2)
+        indices = [self.tile_points[tile] for tile in
+                   self.tiles.covering(area.left, area.top,
+                                       area.right, area.bottom)
+                   if tile in self.tile_points]
+        if not indices:
+            return
+        indices = numpy.concatenate(indices)
+        x, y = self.point_x[indices], self.point_y[indices]
+        inside = ((x >= area.left) & (x < area.right) &
+                  (y >= area.top) & (y < area.bottom))
+        indices = indices[inside]
+        x = x[inside].astype(int) - offset[0]
+        y = y[inside].astype(int) - offset[1]
+
+        inks = [color_table[scheme_ids[color]][AVATAR]
+                for color in self.colors]
+        colors = self.points.color
+        flags = self.points.flags
+        for i, px, py in zip(indices.tolist(), x.tolist(), y.tolist()):
+            if flags[i] & sim.Points.UNHITTABLE:
+                color = (100, 100, 100)
+            else:
+                color = inks[colors[i]]
+            draw.circle(surface, color, (px, py), radius,
+                        1 if flags[i] & sim.Points.HIT else 0)
+
+    def point_area(self, point):
+        """
+        The area of the spiral a point is drawn in
+        """
+        x = self.point_x[point.index]
+        y = self.point_y[point.index]
+        size = self.point_radius * 2 + 3
+        return pygame.Rect(int(x) - size / 2, int(y) - size / 2, size, size)
 
-class Avatar():
+class TileCache():
+    """
+    Least recently used cache of background tiles. Tiles are rendered by the
+    spiral when first asked for and the oldest ones are dropped once the
+    cache holds more than `budget` bytes of pixels.
+    """
+    def __init__(self, spiral, size=TILE_SIZE, budget=TILE_BUDGET):
+        self.spiral = spiral
+        self.size = size
+        self.budget = budget
+        self.columns = -(-spiral.width // size)
+        self.rows = -(-spiral.height // size)
+        self.clear()
+
+    def clear(self):
+        self.tiles = OrderedDict()
+        self.used = 0
+
+    def covering(self, left, top, right, bottom):
+        """
+        The coordinates of every tile touching the given (inclusive) bounds
+        """
+        size = self.size
+        for ty in xrange(max(int(top) // size, 0),
+                         min(int(bottom) // size, self.rows - 1) + 1):
+            for tx in xrange(max(int(left) // size, 0),
+                             min(int(right) // size, self.columns - 1) + 1):
+                yield tx, ty
+
+    def get(self, tx, ty):
+        tile = self.tiles.pop((tx, ty), None)
+        if tile is None:
+            return self.add(tx, ty, self.spiral.load_tile(tx, ty))
+        self.tiles[tx, ty] = tile
+        return tile
+
+    def add(self, tx, ty, tile):
+        self.tiles[tx, ty] = tile
+        self.used += tile.get_pitch() * tile.get_height()
+        self.evict()
+        return tile
+
+    def evict(self):
+        while self.used > self.budget and self.tiles:
+            _, tile = self.tiles.popitem(last=False)
+            self.used -= tile.get_pitch() * tile.get_height()
+
+class Avatar(sim.Avatar):
     def __init__(self, logic, screen, size=12):
+        sim.Avatar.__init__(self, logic, screen.spiral)
         self.logic = logic
         self.screen = screen
         self.spiral = screen.spiral
-        self.t = screen.spiral.init
-        self.speed = avatar_speeds[self.logic.difficulty]
         self.size = size
-        self.dev = 0
-        self.bouncing = False
 
     @property
-    def polar(self):
+    def shown_t(self):
         """
-        The polar coords of the avatar. (r, theta)
+        Where the avatar is drawn: between its last two positions, as far on
+        as the time left over since the last step.
         """
-        return self.screen.spiral.radius(self.t, self.dev), self.t
-
-    def change_dev(self, change):
-        if -3 < self.dev + change < 3:
-            self.dev += change
+        return self.last_t + (self.t - self.last_t) * self.screen.alpha
 
     def draw(self, surface):
-        r = self.screen.spiral.radius(self.t, self.dev)
-        abs_pos = self.screen.to_cart(self.t, r)
+        r = self.screen.spiral.radius(self.shown_t, self.dev)
+        abs_pos = self.screen.to_cart(self.shown_t, r)
         s_pos = self.screen.screen_pos
         pos = (abs_pos[0] - s_pos[0], abs_pos[1] - s_pos[1])
-        draw.circle(surface, self.screen.gc("avatar"), map(int, pos), self.size)
-
-    def update(self, t_delta):
-        d_delta = self.speed * t_delta
-        self.t += d_delta / self.spiral.radius(self.t)
-        if not (self.spiral.init < self.t < self.spiral.max):
-            self.logic.running = False
-
-        if self.bouncing:
-            if self.speed < self.pre_speed:
-                self.speed += 10
-            else:
-                self.bouncing = False
-
-    def correct_point_hit(self):
-        self.speed += 3
-
-    def incorrect_point_hit(self):
-        self.bouncing = True
-        self.pre_speed = self.speed
-        self.speed *= -1
-        self.speed += 5
+        return draw.circle(surface, self.screen.color(AVATAR), map(int, pos),
+                           self.size)
 
     def cart_screen(self, dev=True):
-        r = self.screen.spiral.radius(self.t, self.dev)
-        return self.screen.to_cart(self.t, r)
+        r = self.screen.spiral.radius(self.shown_t, self.dev)
+        return self.screen.to_cart(self.shown_t, r)
 
     def cart_viewport(self, dev=True):
         return self.screen.adjust_to_viewport(self.cart_screen(dev))
 
-    def on_path(self):
-        for path in self.spiral.paths_by_color[self.logic.current_color]:
-            if path.inside(self.t, self.dev):
-                return True
-        return False
-
-    def on_any_path(self):
-        for path in self.spiral.paths_by_dev[self.dev]:
-            if path.inside(self.t, self.dev):
-                return True
-        return False
-
-    def get_on_path(self):
-        for path in self.spiral.paths_by_dev[self.dev]:
-            if path.inside(self.t, self.dev):
-                return path
-
 class ParticleManager():
     def __init__(self, logic, screen):
         self.screen = screen
@@ -424,10 +648,8 @@ class ParticleManager():
 
         self.point_ps = {}
         for color in logic.colors:
-            names = ("p1", "p2", "p3", "p4")
-            particle_colors = []
-            for name in names:
-                particle_colors.append(self.screen.gc(name, color))
+            scheme = color_table[scheme_ids[color]]
+            particle_colors = [scheme[role] for role in (P1, P2, P3, P4)]
             self.point_ps[color] = particles.CircleExplosion(
                 (0, 0), particle_colors, [0, 100], 20)
             self.path_ps = particles.SparkSystem(
@@ -458,32 +680,120 @@ class ParticleManager():
         pass
 
     def draw(self, surface):
+        """
+        Draws the particles, returning the rects they cover
+        """
         point_ps = self.point_ps[self.logic.current_color]
-        point_ps.draw(surface)
-        self.path_ps.draw(surface)
+        return [rect for rect in (point_ps.draw(surface),
+                                  self.path_ps.draw(surface)) if rect]
 
 class AssetManager():
+    """
+    The images, fonts and sounds shared by every screen, see shared. Each
+    is loaded the first time it is asked for and then kept, counting how
+    often an asset was already loaded (hits) or had to be (misses) and the
+    time spent loading.
+    """
+    font_name = "DIMIS___.TTF"
     font_size = 50
+    text_cache_size = 64
+    glyphs = "0123456789,"
+    images = {'blue': 'a.png',
+              'red': 's.png',
+              'green': 'd.png',
+              'yellow': 'f.png'}
+    instance = None
+
+    @classmethod
+    def shared(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
 
     def __init__(self):
-        names = {'blue': 'a',
-                 'red': 's',
-                 'green': 'd',
-                 'yellow': 'f'}
         self.assets = {}
-        for color, key in names.items():
-            surf = image.load(os.path.join("data", key + ".png")).convert()
-            surf.set_colorkey((0, 0, 0))
-            self.assets[color] = surf
+        self.hits = 0
+        self.misses = 0
+        self.load_time = 0.
+        self.text_cache = OrderedDict()
+        self.glyph_atlas = {}
+
+    def load(self, key, loader, *args):
+        asset = self.assets.get(key)
+        if asset is None:
+            self.misses += 1
+            start = time.time()
+            asset = self.assets[key] = loader(*args)
+            self.load_time += time.time() - start
+        else:
+            self.hits += 1
+        return asset
 
-        self.font = font.Font(os.path.join("data", "DIMIS___.TTF"),
-                              self.font_size)
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'load_time': self.load_time}
 
-    def render_text(self, text, color):
-        return self.font.render(text, True, color)
+    def load_image(self, filename):
+        surf = image.load(os.path.join("data", filename)).convert()
+        surf.set_colorkey((0, 0, 0))
+        return surf
 
     def get(self, name):
-        return self.assets[name]
+        """
+        The image for the given colour, or the image file of that name
+        """
+        return self.load(("image", name), self.load_image,
+                         self.images.get(name, name))
+
+    def get_font(self, size=None):
+        size = size or self.font_size
+        return self.load(("font", size), font.Font,
+                         os.path.join("data", self.font_name), size)
+
+    def sounds(self):
+        return self.load("sounds", audio.SoundBank)
+
+    def cache_text(self, key, surf):
+        self.text_cache[key] = surf
+        if len(self.text_cache) > self.text_cache_size:
+            self.text_cache.popitem(last=False)
+        return surf
+
+    def render_text(self, text, color):
+        key = (text, tuple(color))
+        surf = self.text_cache.pop(key, None)
+        if surf is None:
+            surf = self.get_font().render(text, True, color)
+        return self.cache_text(key, surf)
+
+    def render_number(self, label, number, color):
+        """
+        Renders `label` followed by the digits in the string `number`. The
+        digits are put together from pre-rendered glyphs, so a changing
+        number doesn't need the font to rasterise anything.
+        """
+        if number.strip(self.glyphs):
+            return self.render_text(label + number, color)
+        key = (label + number, tuple(color))
+        surf = self.text_cache.pop(key, None)
+        if surf is not None:
+            return self.cache_text(key, surf)
+
+        parts = [self.render_text(label, color)]
+        for char in number:
+            if (char, key[1]) not in self.glyph_atlas:
+                self.glyph_atlas[char, key[1]] = self.get_font().render(
+                    char, True, color)
+            parts.append(self.glyph_atlas[char, key[1]])
+
+        surf = pygame.Surface((sum(part.get_width() for part in parts),
+                               max(part.get_height() for part in parts)),
+                              pygame.SRCALPHA, 32)
+        x = 0
+        for part in parts:
+            surf.blit(part, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            x += part.get_width()
+        return self.cache_text(key, surf)
 
 class HUD():
     def __init__(self, screen, logic):
@@ -491,6 +801,14 @@ class HUD():
         self.logic = logic
         self.bounds = []
 
+    def state(self):
+        """
+        Everything the HUD shows. It only has to be drawn again when this
+        changes.
+        """
+        return (self.logic.current_color, format_score(self.logic.score),
+                int(self.logic.bonus))
+
     def draw(self, surface):
         assets = self.screen.assets
         items = self.logic.colors
@@ -507,17 +825,16 @@ class HUD():
                      .get_height())
                     ))
 
-        score = format_score(self.logic.score)
-        score = assets.render_text(
-            "Score: " + score,
-            self.screen.gc("avatar"))
+        score = assets.render_number(
+            "Score: ", format_score(self.logic.score),
+            self.screen.color(AVATAR))
         y = VHEIGHT - 20 - score.get_height() * 2
         x = (VWIDTH - score.get_width())/2
         surface.blit(score, (x, y))
 
-        bonus = assets.render_text(
-            "Bonus: " + str(int(self.logic.bonus)),
-            self.screen.gc("avatar"))
+        bonus = assets.render_number(
+            "Bonus: ", str(int(self.logic.bonus)),
+            self.screen.color(AVATAR))
         y = VHEIGHT - 10 - bonus.get_height()
         x = (VWIDTH - bonus.get_width())/2
         surface.blit(bonus, (x, y))
@@ -528,54 +845,270 @@ class HUD():
                 self.logic.change_color(i)
                 return True
 
+class Layer():
+    """
+    Stands in for a surface, keeping what is blitted onto it so it can be
+    blitted again as it is until it changes.
+    """
+    def __init__(self):
+        self.blits = []
+        self.rects = []
+
+    def blit(self, source, dest):
+        rect = pygame.Rect(dest, source.get_size())
+        self.blits.append((source, rect))
+        self.rects.append(rect)
+        return rect
+
+    def draw(self, surface):
+        for source, rect in self.blits:
+            surface.blit(source, rect)
+
+class Compositor():
+    """
+    Draws a screen in layers, keeping what it can from the last frame:
+     - The world, the background and the points, is kept on a surface of
+       its own. When the camera moves it is scrolled and only the strips
+       uncovered are painted, and otherwise only areas that changed are.
+     - Effects, the particles and the avatar, are drawn over it every
+       frame and wiped by restoring the world under them the next.
+     - The HUD is kept as a Layer, drawn again only when its state changes.
+
+    While the camera is still only the rects that changed are returned, so
+    the display can be updated with just those.
+    """
+    def __init__(self, screen, points=True, effects=True):
+        self.screen = screen
+        self.points = points
+        self.effects = effects
+        self.viewport = pygame.Rect(0, 0, VWIDTH, VHEIGHT)
+        self.world = None
+        self.world_pos = None
+        # Areas of the spiral to paint again
+        self.changed = []
+        self.effect_rects = []
+        self.hud = Layer()
+        self.hud_state = None
+
+    def invalidate(self, area=None):
+        """
+        Has the given area of the spiral, or all of it, painted again
+        """
+        if area is None:
+            self.world_pos = None
+        else:
+            self.changed.append(area)
+
+    def paint_world(self, rect):
+        """
+        Paints the given rect of the world layer
+        """
+        spiral = self.screen.spiral
+        profiler = self.screen.profiler
+        area = rect.move(self.world_pos)
+        self.world.set_clip(rect)
+        with profiler.stage("background"):
+            spiral.blit_area(self.world, area, rect.topleft)
+        if self.points:
+            with profiler.stage("points"):
+                spiral.draw_points(self.world, area, self.world_pos)
+        self.world.set_clip(None)
+
+    def update_world(self):
+        """
+        Brings the world layer up to date with the camera. Returns the rects
+        of it that changed, or None if it moved.
+        """
+        if self.world is None:
+            self.world = pygame.Surface((VWIDTH, VHEIGHT), 0,
+                                        display.get_surface())
+        pos = tuple(map(int, self.screen.screen_pos))
+        old = self.world_pos
+        self.world_pos = pos
+        if old is None or abs(pos[0] - old[0]) >= VWIDTH or \
+                abs(pos[1] - old[1]) >= VHEIGHT:
+            self.changed = []
+            self.paint_world(self.viewport)
+            return None
+
+        dx, dy = pos[0] - old[0], pos[1] - old[1]
+        rects = []
+        if dx or dy:
+            self.world.scroll(-dx, -dy)
+            if dx:
+                rects.append(pygame.Rect(VWIDTH - dx if dx > 0 else 0, 0,
+                                         abs(dx), VHEIGHT))
+            if dy:
+                rects.append(pygame.Rect(0, VHEIGHT - dy if dy > 0 else 0,
+                                         VWIDTH, abs(dy)))
+        for area in self.changed:
+            rect = area.move(-pos[0], -pos[1]).clip(self.viewport)
+            if rect.width and rect.height:
+                rects.append(rect)
+        self.changed = []
+        for rect in rects:
+            self.paint_world(rect)
+        if dx or dy:
+            return None
+        return rects
+
+    def draw(self, surface):
+        """
+        Draws the screen onto `surface`, which holds the last frame drawn.
+        Returns the rects of it that changed, or None if all of it did.
+        """
+        profiler = self.screen.profiler
+        world = self.update_world()
+        hud = self.screen.logic.hud
+        state = hud.state()
+        with profiler.stage("background"):
+            if world is None:
+                surface.blit(self.world, (0, 0))
+                changed = None
+            else:
+                changed = world + self.effect_rects
+                if state != self.hud_state:
+                    changed += self.hud.rects
+                # The HUD is blended, so it is always drawn over the world
+                # again rather than over itself
+                for rect in changed + self.hud.rects:
+                    surface.blit(self.world, rect, rect)
+
+        self.effect_rects = []
+        if self.effects:
+            with profiler.stage("effects"):
+                logic = self.screen.logic
+                self.effect_rects = logic.particles.draw(surface)
+                self.effect_rects.append(logic.avatar.draw(surface))
+
+        with profiler.stage("hud"):
+            if state != self.hud_state:
+                self.hud = Layer()
+                hud.draw(self.hud)
+                self.hud_state = state
+                if changed is not None:
+                    changed += self.hud.rects
+            self.hud.draw(surface)
+
+        # The profiler's overlay is wiped like the effects
+        overlay = profiler.draw(surface)
+        if overlay:
+            self.effect_rects.append(overlay)
+
+        if changed is not None:
+            changed += self.effect_rects
+        return changed
+
 class Screen():
     width, height = 5000, 5000
     dimmer = None
     dim = 0
     menu_state = "ok"
     running = True
-
-    def __init__(self, clock, difficulty):
+    # Time not yet stepped through, as a number of seconds and of steps
+    lag = 0
+    alpha = 0
+    # How far along preparing the spiral is, from 0 to 1
+    progress = 0
+    # Shared by every screen, see toggle_profiler. main sets up the one
+    # asked for by ME_PROFILE.
+    profiler = profiling.NullProfiler()
+    idle_profiler = None
+
+    def __init__(self, clock, difficulty, seed=None):
         self.clock = clock
-        self.logic = Logic(self, difficulty)
+        self.logic = Logic(self, difficulty, seed)
         self.spiral = Spiral(self.width, self.height,
                              self.logic.colors,
                              self, self.logic)
         self.logic.create_spiral_dependants()
-        self.last = datetime.utcnow()
-        self.assets = AssetManager()
+        self.assets = AssetManager.shared()
+        self.compositor = Compositor(self)
 
     def show(self):
-        self.spiral.prepare()
+        preparing = self.load(self.spiral.preparing())
         self.start_music()
         self.logic.change_color(0)
 
+        self.last_tick = pygame.time.get_ticks()
         while self.logic.running:
+            profiler = self.profiler
+            with profiler.stage("events"):
+                for event in pygame.event.get():
+                    self.logic.handle_event(event)
+            self.update()
+            if preparing:
+                with profiler.stage("prepare"):
+                    preparing = self.prepare_for(preparing, PREPARE_TIME)
+
+            rects = self.draw_all()
+            with profiler.stage("flip"):
+                if rects is None:
+                    display.flip()
+                else:
+                    display.update(rects)
+            self.clock.tick(FPS)
+            profiler.frame()
+
+            if android:
+                if android.check_pause():
+                    android.wait_for_resume()
+        if preparing:
+            preparing.close()
+
+    def load(self, preparing):
+        """
+        Shows the loading screen while the spiral is prepared, until the
+        background around the start is ready. Returns what is left of the
+        preparation, or None if it is all done.
+        """
+        while preparing and not self.spiral.ready and self.logic.running:
             for event in pygame.event.get():
                 self.logic.handle_event(event)
-            self.update()
+            preparing = self.prepare_for(preparing, 1. / FPS)
 
-            self.draw_all()
+            self.draw_loading(display.get_surface())
             display.flip()
-            self.clock.tick(FPS)
 
             if android:
                 if android.check_pause():
                     android.wait_for_resume()
+        return preparing
+
+    def prepare_for(self, preparing, duration):
+        """
+        Carries on preparing the spiral for about `duration` seconds.
+        Returns the preparation, or None once it is done.
+        """
+        end = pygame.time.get_ticks() + duration * 1000
+        for self.progress in preparing:
+            if pygame.time.get_ticks() >= end:
+                return preparing
+        return None
+
+    def draw_loading(self, surface):
+        surface.fill(self.color(BACKGROUND))
+        color = self.color(AVATAR)
+        text = self.assets.render_number("Loading ",
+                                         str(int(self.progress * 100)), color)
+        x = (VWIDTH - text.get_width()) / 2
+        y = VHEIGHT / 2 - text.get_height()
+        surface.blit(text, (x, y))
+        bar = pygame.Rect(VWIDTH / 4, VHEIGHT / 2 + 20, VWIDTH / 2, 20)
+        draw.rect(surface, color, bar, 2)
+        bar.width *= self.progress
+        draw.rect(surface, color, bar)
 
     def draw(self, surface):
         """
-        Draw the game onto the given surface
+        Draw the game onto the given surface, which still holds the last
+        frame. Returns the rects that changed, or None if all of it did.
 
         Arguments:
         - `self`:
         - `surface`:
         """
-        self.spiral.get_background(surface)
-        self.spiral.draw_points(surface)
-        self.logic.particles.draw(surface)
-        self.logic.avatar.draw(surface)
-        self.logic.hud.draw(surface)
+        return self.compositor.draw(surface)
 
     def draw_all(self):
         """
@@ -585,47 +1118,72 @@ class Screen():
         - `self`:
         """
         disp = display.get_surface()
-        self.draw(disp)
+        return self.draw(disp)
 
     def to_cart(self, t, r=None, force_int=False):
         r = r or self.spiral.radius(t)
         return to_cartesian(t, r, self.spiral.center, force_int)
 
-    def gc(self, color_name, current=None):
-        return gc(color_name, current or self.logic.current_color)
+    def color(self, role, scheme=None):
+        """
+        The colour of a role in the given scheme, or the current one
+        """
+        if scheme is None:
+            scheme = scheme_ids[self.logic.current_color]
+        return color_table[scheme][role]
 
     def adjust_to_viewport(self, (x, y)):
         return (x - self.screen_pos[0], y - self.screen_pos[1])
 
-    def play_sound(self, name):
-        if android:
-            import android_mixer as mixer
-        else:
-            from pygame import mixer
-            mixer.init()
-        sound = mixer.Sound(os.path.join("data", "{0}.ogg".format(name)))
-        sound.play()
+    def play_sound(self, *names):
+        self.assets.sounds().play(*names)
 
     @property
     def screen_pos(self):
-        screen_pos = list(self.to_cart(self.logic.avatar.t))
+        screen_pos = list(self.to_cart(self.logic.avatar.shown_t))
         screen_pos[0] -= VWIDTH/2
         screen_pos[1] -= VHEIGHT/2
         return tuple(screen_pos)
 
     def update(self):
-        self.logic.update()
-        self.last = datetime.utcnow()
+        now = pygame.time.get_ticks()
+        self.step((now - self.last_tick) / 1000.)
+        self.last_tick = now
+
+    def step(self, frame_time):
+        """
+        Moves the game on by frame_time seconds, in as many whole steps as
+        fit. What is left over is used to interpolate the avatar and camera
+        between the last two steps.
+        """
+        self.lag += min(frame_time, MAX_FRAME_TIME)
+        with self.profiler.stage("update"):
+            while self.lag >= STEP and self.logic.running:
+                self.logic.update(STEP)
+                self.lag -= STEP
+        self.alpha = self.lag / STEP
+        with self.profiler.stage("particles"):
+            self.logic.particles.update(frame_time)
+
+    @classmethod
+    def toggle_profiler(cls):
+        """
+        Turns the profiler on or off for every screen. A profiler turned
+        off is kept, so turning it on again carries on with its trace.
+        """
+        profiler = Screen.idle_profiler
+        if profiler is None:
+            if Screen.profiler.enabled:
+                profiler = profiling.NullProfiler()
+            else:
+                profiler = profiling.Profiler()
+        Screen.idle_profiler, Screen.profiler = Screen.profiler, profiler
 
     def start_music(self):
-        self.play_sound("Intermission")
+        self.assets.sounds().play_music("Intermission")
 
     def stop(self):
-        try:
-            import pygame.mixer as mixer
-        except ImportError, NotImplementedError:
-            import android_mixer as mixer
-        mixer.fadeout(1000)
+        self.assets.sounds().fadeout(1000)
 
 class MenuLogic(Logic):
     selected = 0
@@ -654,46 +1212,52 @@ class MenuLogic(Logic):
             elif event.key == pygame.K_ESCAPE:
                 self.selected = self.entries.index("Exit")
                 self.running = False
+            elif event.key in self.profiler_keys:
+                self.screen.toggle_profiler()
         if event.type == pygame.MOUSEBUTTONDOWN:
             self.hud.screen_pressed(event.pos)
 
-    def update(self):
-        Logic.update(self)
+    def update(self, t_delta):
+        Logic.update(self, t_delta)
         if not self.running and (self.avatar.t > self.screen.spiral.max or\
                                  self.avatar.t < self.screen.spiral.init + 1):
             self.running = True
             self.avatar.speed *= -1
 
 class MenuScreen(Screen):
+    # Always the same level, so it can be loaded from the cache
+    seed = 0
+
     def __init__(self, clock):
         self.clock = clock
-        self.logic = MenuLogic(self, "hard")
+        self.logic = MenuLogic(self, "hard", self.seed)
         self.spiral = Spiral(self.width, self.height,
                              self.logic.colors,
                              self, self.logic)
         self.logic.create_spiral_dependants()
-        self.last = datetime.utcnow()
-        self.assets = AssetManager()
+        self.assets = AssetManager.shared()
+        self.compositor = Compositor(self, points=False, effects=False)
 
     def show(self):
         Screen.show(self)
         index = self.logic.selected % len(self.logic.entries)
         return self.logic.entries[index].lower()
 
-    def draw(self, surface):
-        self.spiral.get_background(surface)
-        self.logic.hud.draw(surface)
-
 class MenuHUD(HUD):
+    def state(self):
+        return (self.logic.selected % len(self.logic.entries),
+                self.logic.current_color)
+
     def draw(self, surface):
         self.bounds = []
         for i, entry in enumerate(self.logic.entries):
             if i == self.logic.selected % len(self.logic.entries)\
                     and not android:
-                color = "spiral_color"
+                color = SPIRAL_COLOR
             else:
-                color = "avatar"
-            text = self.screen.assets.render_text(entry, self.screen.gc(color))
+                color = AVATAR
+            text = self.screen.assets.render_text(entry,
+                                                  self.screen.color(color))
             y_offset = (VHEIGHT - text.get_height() * len(self.logic.entries) +\
                             20 * len(self.logic.entries))/2
             x = (VWIDTH - text.get_width())/2
@@ -755,21 +1319,86 @@ class HighScoreManager():
         with open(self.filename, "w") as score_file:
             score_file.write(json.dumps(self.scores))
 
+    def save_replay(self, game):
+        """
+        Saves the replay of a finished game next to the high scores, so its
+        score can be checked later.
+        """
+        if not hasattr(self, "filename"):
+            return
+        directory = os.path.join(os.path.dirname(self.filename), "replays")
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+        game.recorder.score = game.score
+        game.recorder.save(os.path.join(
+                directory, "{0}-{1}.replay".format(game.seed, int(game.score))))
+
 class ScoreScreen():
-    def __init__(self, clock, screen, score, color):
+    dim_max = 30
+    dim_min = 4
+    zoom_step = 10
+
+    def __init__(self, clock, spiral, score, color):
         self.clock = clock
         self.color = color
-        self.screen = screen
-        self.zoom_size = list(self.screen.get_size())
+        self.spiral = spiral
+        self.zoom_size = [spiral.width, spiral.height]
         self.points = score
         self.dim = 0
         self.menu_state = "ok"
         self.dimmer = None
-        self.assets = AssetManager()
+        self.assets = AssetManager.shared()
         self.running = True
         self.show_highscore = False
         self.highscore_bound = None
         self.scores = HighScoreManager()
+        self.frame = None
+
+        # Build the pyramid while the screen dims out
+        self.pyramid = []
+        self.builder = threading.Thread(target=self.build_pyramid)
+        self.builder.daemon = True
+        self.builder.start()
+
+    def build_pyramid(self):
+        """
+        Renders the middle of the spiral, as much of it as will be on screen
+        once zoomed out the furthest, followed by halved copies for as long
+        as the zoom gets small enough to use them.
+        """
+        shrink = self.zoom_step * (self.dim_max - self.dim_min + 2)
+        scale = min((self.spiral.width - shrink) / float(self.spiral.width),
+                    (self.spiral.height - shrink) / float(self.spiral.height))
+        area = pygame.Rect((0, 0), (VWIDTH / scale + 1, VHEIGHT / scale + 1))
+        area.center = self.spiral.center
+        level = self.spiral.render_area(area)
+        self.pyramid.append(level)
+        while scale <= 0.5 ** len(self.pyramid):
+            level = transform.smoothscale(
+                level, (level.get_width() / 2, level.get_height() / 2))
+            self.pyramid.append(level)
+
+    def draw_zoomed(self, viewport):
+        """
+        Draws the spiral scaled to the current zoom, from the smallest level
+        of the pyramid that is still at least that size.
+        """
+        self.builder.join()
+        scale = (self.zoom_size[0] / float(self.spiral.width),
+                 self.zoom_size[1] / float(self.spiral.height))
+        level = 0
+        while level + 1 < len(self.pyramid) and \
+                min(scale) <= 0.5 ** (level + 1):
+            level += 1
+        surf = self.pyramid[level]
+        area = pygame.Rect((0, 0), (VWIDTH / scale[0] / 2 ** level,
+                                    VHEIGHT / scale[1] / 2 ** level))
+        area.center = surf.get_rect().center
+        area = area.clip(surf.get_rect())
+        viewport.blit(transform.scale(surf.subsurface(area),
+                                      (VWIDTH, VHEIGHT)), (0, 0))
 
     def draw(self):
         viewport = display.get_surface()
@@ -782,16 +1411,15 @@ class ScoreScreen():
             self.dimmer.set_alpha(self.dim)
             self.dim += 1
             viewport.blit(self.dimmer, (0, 0))
-            if self.dim > 30:
+            if self.dim > self.dim_max:
                 self.menu_state = "dim_in_zoom"
                 self.dimmer = None
-        if self.menu_state in ("dim_in_zoom", "wait"):
+        if self.menu_state == "wait" and self.frame:
+            viewport.blit(self.frame, (0, 0))
+        elif self.menu_state in ("dim_in_zoom", "wait"):
             if not self.dimmer:
                 self.dimmer = pygame.Surface(display.get_surface().get_size())
-            scaled = transform.scale(self.screen, self.zoom_size)
-            viewport.blit(scaled,
-                          ((-scaled.get_width() + VWIDTH)/2,
-                           (-scaled.get_height() + VHEIGHT)/2))
+            self.draw_zoomed(viewport)
 
             self.draw_score(viewport)
             self.draw_highscores(viewport)
@@ -800,18 +1428,20 @@ class ScoreScreen():
             if self.menu_state == "dim_in_zoom":
                 self.dimmer.set_alpha(self.dim)
                 self.dim -= 1
-                self.zoom_size[0] -= 10
-                self.zoom_size[1] -= 10
+                self.zoom_size[0] -= self.zoom_step
+                self.zoom_size[1] -= self.zoom_step
 
             viewport.blit(self.dimmer, (0, 0))
-            if self.dim < 4:
+            if self.menu_state == "wait":
+                self.frame = viewport.copy()
+            if self.dim < self.dim_min:
                 self.menu_state = "wait"
 
     def draw_score(self, viewport):
         score = format_score(self.points)
         raw = "Score: {0}".format(score)
-        surf = self.assets.render_text(raw, from_hex(
-                colors[self.color]["avatar"]))
+        surf = self.assets.render_text(
+            raw, color_table[scheme_ids[self.color]][AVATAR])
         y = 350
         x = (VWIDTH - surf.get_width())/2
         viewport.blit(surf, (x, y))
@@ -820,8 +1450,8 @@ class ScoreScreen():
         highscore = self.scores.score_position(self.points)
         if highscore != -1:
             raw = "New Highscore!"
-            surf = self.assets.render_text(raw, from_hex(
-                    colors[self.color]["avatar"]))
+            surf = self.assets.render_text(
+                raw, color_table[scheme_ids[self.color]][AVATAR])
             y = 420
             x = (VWIDTH - surf.get_width())/2
             viewport.blit(surf, (x, y))
@@ -832,12 +1462,11 @@ class ScoreScreen():
                 if high == 0:
                     continue
                 if highscore == i:
-                    color = colors["yellow"]["border_color"]
+                    color = color_table[YELLOW][BORDER_COLOR]
                 else:
-                    color = colors[self.color]["avatar"]
+                    color = color_table[scheme_ids[self.color]][AVATAR]
                 raw = str(i + 1) + ": " + format_score(high)
-                surf = self.assets.render_text(raw, from_hex(
-                        color))
+                surf = self.assets.render_text(raw, color)
                 y = 490 + 70 * i
                 x = (VWIDTH - surf.get_width())/2
                 viewport.blit(surf, (x, y))
@@ -848,120 +1477,30 @@ class ScoreScreen():
         if self.highscore_bound and event.type == pygame.MOUSEBUTTONDOWN:
             if self.highscore_bound.collidepoint(event.pos):
                 self.show_highscore = not self.show_highscore
+                self.frame = None
+        elif event.type == pygame.KEYDOWN and \
+                event.key in Logic.profiler_keys:
+            Screen.toggle_profiler()
         elif event.type in (pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN):
             self.running = False
 
     def show(self):
         while self.running:
-            self.draw()
-            display.flip()
+            profiler = Screen.profiler
+            with profiler.stage("background"):
+                self.draw()
+            profiler.draw(display.get_surface())
+            with profiler.stage("flip"):
+                display.flip()
             self.clock.tick(FPS)
-            for event in pygame.event.get():
-                self.handle_event(event)
+            with profiler.stage("events"):
+                for event in pygame.event.get():
+                    self.handle_event(event)
+            profiler.frame()
             if android:
                 if android.check_pause():
                     android.wait_for_resume()
 
-class Path():
-    def __init__(self, spiral,
-                 start, end, color, dev):
-        self.start = start
-        self.end = end
-        self.color = color
-        self.points = []
-        self.dev = dev
-        self.spiral = spiral
-
-    def generate_points(self, count):
-        length = self.end - self.start
-        s_offset = random.random() * length / 3.
-        e_offset = random.random() * length / 3.
-        t = self.start + s_offset
-        d = ((self.end - e_offset) - (self.start - s_offset))/float(count)
-        while t < self.end:
-            unhittable = int(random.random() * 100) == 0
-            self.points.append(Point(t, self, unhittable))
-            t += d
-
-    def intersect(self, path):
-        if self.dev != path.dev:
-            return False
-
-        if path.start < self.start < path.end:
-            return True
-        if path.start < self.end < path.end:
-            return True
-        if self.start < path.start < self.end:
-            return True
-        if self.start < path.end < self.end:
-            return True
-        return False
-
-    def passed(self, start, end):
-        for point in self.points:
-            if start < point.t < end and not point.hit:
-                return point
-
-    def inside(self, t, dev):
-        if dev != self.dev:
-            return False
-        return self.start < t < self.end
-
-    def draw(self, surface):
-        points = []
-        t = self.start
-        si = self.spiral.interval
-        while t <= self.end:
-            t += si / self.spiral.radius(t)
-            r = self.spiral.radius(t + self.dev * pi/4.)
-            pos = self.spiral.screen.to_cart(t, r)
-            points.append(pos)
-
-        draw.lines(surface, self.spiral.screen.gc("avatar", self.color),
-                   False, points, 3)
-
-class Point():
-    def __init__(self, t, path, unhittable=False):
-        self.t = t
-        self.path = path
-        self.spiral = path.spiral
-        self.dev = path.dev
-        self.r = self.spiral.radius(self.t, self.dev)
-        self.color = path.color if not unhittable else "grey"
-        self.hit = False
-        self.unhittable = unhittable
-
-    def passed(self, t1, t2, r):
-        if self.hit:
-            return False
-        if abs(r - self.r) > 1:
-            return False
-        if t1 < self.t < t2:
-            return True
-        else:
-            return False
-
-    x = None
-    y = None
-    def cart(self):
-        if not self.y:
-            x, y = self.spiral.screen.to_cart(self.t, self.r)
-            self.x = x
-            self.y = y
-        return self.x, self.y
-
-    screen = pygame.Rect((0, 0), (VWIDTH, VHEIGHT))
-    def draw(self, surface):
-        pos = self.spiral.screen.adjust_to_viewport(self.cart())
-        if not self.screen.collidepoint(pos):
-            return
-        pos = map(int, pos)
-        if self.unhittable:
-            color = (100, 100, 100)
-        else:
-            color = self.spiral.screen.gc("avatar", self.color)
-        draw.circle(surface, color, pos, 10, 1 if self.hit else 0)
-
 def main():
     flags = 0
     if RELEASE:
@@ -972,6 +1511,7 @@ def main():
     if android:
         android.init()
         android.map_key(android.KEYCODE_BACK, pygame.K_ESCAPE)
+    Screen.profiler = profiling.create()
     while 1:
         clock = pygame.time.Clock()
         choice = MenuScreen(clock).show()
@@ -983,10 +1523,11 @@ def main():
 
 def play_game(clock, difficulty):
     s = Screen(clock, difficulty)
+    s.logic.recorder = replay.Replay(difficulty, s.logic.seed)
     s.show()
+    HighScoreManager().save_replay(s.logic)
     color = s.logic.current_color
-    screen = s.spiral.spirals[color]
-    ss = ScoreScreen(clock, screen, s.logic.score or 0, color)
+    ss = ScoreScreen(clock, s.spiral, s.logic.score or 0, color)
     ss.show()
 
 if __name__ == "__main__":
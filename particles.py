@@ -1,6 +1,4 @@
-import random
-from math import cos, sin, radians
-
+import numpy
 import pygame
 import pygame.draw
 
@@ -27,12 +25,24 @@ def get_color(proportion, colorarray):
     between_color = (int(red),int(green),int(blue))
     return between_color
 
+def gradient(colorarray, frames):
+    """
+    The colour of a particle at each age from 0 to frames - 1
+    """
+    return tuple(get_color(age / float(frames), colorarray)
+                 for age in xrange(int(frames)))
+
 class SparkSystem(object):
     """
     A system for creating particles that maybe look a little bit like
     sparks coming off a rail. Derived from padlib.py.
+
+    The particles live in a pool of arrays, one per attribute. Every spark
+    lasts the same number of frames, so the pool is filled round robin and
+    only grows when the slot it would reuse is still alive.
     """
-    def __init__(self, position, colorarray, speedrange, disperse, direction, density, frames):
+    def __init__(self, position, colorarray, speedrange, disperse, direction,
+                 density, frames, capacity=256):
         self.pos = position
         self.colorarray = colorarray
         self.speedrange = speedrange
@@ -40,55 +50,126 @@ class SparkSystem(object):
         self.direction = direction
         self.density = density
         self.frames = float(frames)
-        self.particles = []
+        self.colors = gradient(colorarray, frames)
+
+        self.position = numpy.zeros((capacity, 2))
+        self.velocity = numpy.zeros((capacity, 2))
+        self.angle = numpy.zeros(capacity)
+        self.age = numpy.zeros(capacity, numpy.int32)
+        self.alive = numpy.zeros(capacity, bool)
+        self.head = 0
 
     def change_position(self, pos):
         self.pos = pos
 
     def update(self):
-        for x in xrange(self.density):
-            self.create_new_particle()
-        for p in self.particles:
-            p[0][0] += p[1][0]
-            p[0][1] += p[1][1]
-            p[2] += 1
-            if p[2] == self.frames:
-                self.particles.remove(p)
-
-    def create_new_particle(self):
-        PosBx = self.pos[0]
-        PosBy = self.pos[1]
-        angle = radians(self.direction+((random.random()-0.5)*self.disperse))
-        speed = (random.uniform(self.speedrange[0],self.speedrange[1]))/4.0
-        Speed = [speed*cos(angle),speed*sin(angle)]
-        self.particles.append([[PosBx,PosBy],Speed,0, angle])
+        self.create_new_particles(self.density)
+        self.position += self.velocity
+        self.age += 1
+        self.alive &= self.age < self.frames
+
+    def grow(self):
+        capacity = len(self.age)
+        for name in ("position", "velocity", "angle", "age", "alive"):
+            array = getattr(self, name)
+            grown = numpy.zeros((capacity * 2,) + array.shape[1:], array.dtype)
+            grown[:capacity] = array
+            setattr(self, name, grown)
+        self.head = capacity
+
+    def create_new_particles(self, count):
+        if not count:
+            return
+        # Slots would wrap onto each other if there were fewer than count
+        while True:
+            slots = (self.head + numpy.arange(count)) % len(self.age)
+            if len(self.age) >= count and not self.alive[slots].any():
+                break
+            self.grow()
+
+        angle = numpy.radians(
+            self.direction + (numpy.random.random(count) - 0.5) * self.disperse)
+        speed = numpy.random.uniform(self.speedrange[0], self.speedrange[1],
+                                     count) / 4.0
+        self.position[slots] = self.pos
+        self.velocity[slots, 0] = speed * numpy.cos(angle)
+        self.velocity[slots, 1] = speed * numpy.sin(angle)
+        self.angle[slots] = angle
+        self.age[slots] = 0
+        self.alive[slots] = True
+        self.head = (slots[-1] + 1) % len(self.age)
 
     def draw(self, surface):
         speed = 4
-        for p in self.particles:
-            v = [speed * cos(p[3]), speed * sin(p[3])]
-            color = get_color(p[2] / self.frames, self.colorarray)
-            pygame.draw.line(surface, color, map(int, p[0]),
-                             [int(p[0][0] + v[0]), int(p[0][1] + v[1])])
+        live = numpy.flatnonzero(self.alive)
+        position = self.position[live]
+        angle = self.angle[live]
+        starts = position.astype(int).tolist()
+        ends = (position + speed * numpy.column_stack(
+                (numpy.cos(angle), numpy.sin(angle)))).astype(int).tolist()
+        colors = self.colors
+        for start, end, age in zip(starts, ends, self.age[live].tolist()):
+            pygame.draw.line(surface, colors[age], start, end)
+        if starts:
+            return pygame.Rect(starts[0], (1, 1)).unionall(
+                [pygame.Rect(point, (1, 1)) for point in starts + ends])
 
 class CircleExplosion(object):
-    def __init__(self, pos, colorarray, radiusrange, frames):
+    """
+    Rings expanding out from a point. A ring's radius and colour depend only
+    on its age, so the ring for every age is drawn once and shared by all
+    explosions with the same colours, radii and length.
+    """
+    sprites = {}
+
+    def __init__(self, pos, colorarray, radiusrange, frames, capacity=16):
         self.pos = pos
         self.colorarray = colorarray
         self.sradius, self.eradius = radiusrange
         self.frames = float(frames)
-        self.circles = []
+        self.colors = gradient(colorarray, frames)
+        self.rings = self.get_sprites(self.colors, self.sradius, self.eradius)
+        # Ages of the live rings, oldest first
+        self.circles = numpy.zeros(capacity, numpy.int32)
+        self.count = 0
+
+    @classmethod
+    def get_sprites(cls, colors, sradius, eradius):
+        key = (colors, sradius, eradius)
+        if key not in cls.sprites:
+            rings = []
+            for f, color in enumerate(colors):
+                prop = f / float(len(colors))
+                radius = int(sradius + (eradius - sradius) * prop)
+                surf = pygame.Surface((radius * 2 + 1, radius * 2 + 1))
+                surf.set_colorkey((0, 0, 0))
+                if radius:
+                    pygame.draw.circle(surf, color, (radius, radius),
+                                       radius, 1)
+                rings.append((surf, radius))
+            cls.sprites[key] = rings
+        return cls.sprites[key]
 
     def explode(self):
-        self.circles.append(0)
+        if self.count == len(self.circles):
+            self.circles = numpy.concatenate(
+                (self.circles, numpy.zeros_like(self.circles)))
+        self.circles[self.count] = 0
+        self.count += 1
 
     def update(self):
-        self.circles = map((lambda x: x+1), self.circles)
-        self.circles = filter((lambda x: x < self.frames), self.circles)
+        live = self.circles[:self.count]
+        live += 1
+        expired = numpy.count_nonzero(live >= self.frames)
+        if expired:
+            self.circles[:self.count - expired] = live[expired:]
+            self.count -= expired
 
     def draw(self, surface):
-        for f in self.circles:
-            prop = f / self.frames
-            color = get_color(prop, self.colorarray)
-            radius = int(self.sradius + (self.eradius - self.sradius) * prop)
-            pygame.draw.circle(surface, color, map(int, self.pos), radius, 1)
+        x, y = map(int, self.pos)
+        rects = []
+        for f in self.circles[:self.count].tolist():
+            surf, radius = self.rings[f]
+            rects.append(surface.blit(surf, (x - radius, y - radius)))
+        if rects:
+            return rects[0].unionall(rects)
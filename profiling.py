@@ -0,0 +1,205 @@
+"""
+Timing where each frame's time goes.
+
+Each stage of a frame is timed by wrapping it in `with profiler.stage(name):`
+and every frame ends with `profiler.frame()`. The profiler keeps the last
+HISTORY frames to draw as an overlay: a graph of frame times and a bar per
+stage of its mean time. The samples can also be written to a trace file,
+as CSV or, if its name ends in .json, as JSON.
+
+Set ME_PROFILE to 1, or to the name of a trace file, to start with the
+profiler on, or press F3 while playing. While it is off a NullProfiler
+stands in for it, which does nothing.
+"""
+import atexit, collections, csv, json, os, time
+
+import pygame
+from pygame import draw, font
+
+STAGES = ("events", "update", "particles", "prepare", "background",
+          "points", "effects", "hud", "flip")
+# Frames kept for the overlay
+HISTORY = 120
+# The frame time at the top of the graph, and the one it is marked at
+GRAPH_MAX = 1. / 30
+BUDGET = 1. / 60
+STAGE_COLORS = ((230, 90, 90), (240, 170, 60), (230, 230, 90),
+                (150, 150, 150), (90, 200, 90), (60, 200, 200),
+                (90, 130, 240), (180, 100, 230), (240, 120, 200))
+# Frames between updates of the overlay's numbers
+REFRESH = 15
+
+def create():
+    """
+    The profiler asked for by ME_PROFILE, or a NullProfiler if it is unset
+    """
+    value = os.environ.get("ME_PROFILE")
+    if not value or value == "0":
+        return NullProfiler()
+    return Profiler(None if value == "1" else value)
+
+class NullProfiler():
+    """
+    Stands in for a Profiler while profiling is off
+    """
+    enabled = False
+
+    def stage(self, name):
+        return self
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def frame(self):
+        pass
+
+    def draw(self, surface):
+        return None
+
+class Stage():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        times = self.profiler.current
+        times[self.name] = (times.get(self.name, 0) +
+                            time.time() - self.start)
+
+class Profiler():
+    """
+    Times the stages of every frame, see the module docstring
+
+    Arguments:
+    - `trace`: the file to write every frame's times to, if any
+    - `history`: the number of frames shown on the overlay
+    """
+    enabled = True
+    size = (360, 200)
+
+    def __init__(self, trace=None, history=HISTORY):
+        self.stages = {}
+        # The time spent on each stage so far this frame
+        self.current = {}
+        self.last_frame = None
+        self.frames = collections.deque(maxlen=history)
+        self.count = 0
+        self.font = None
+        self.labels = []
+
+        self.trace = trace
+        self.trace_file = self.writer = None
+        self.json_frames = []
+        if trace:
+            if not trace.endswith(".json"):
+                self.trace_file = open(trace, "wb")
+                self.writer = csv.writer(self.trace_file)
+                self.writer.writerow(("frame", "total") + STAGES)
+            atexit.register(self.close)
+
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(self, name)
+        return stage
+
+    def frame(self):
+        """
+        Ends the frame, recording how long it took since the last one ended
+        """
+        now = time.time()
+        if self.last_frame is not None:
+            total = now - self.last_frame
+            times = self.current
+            self.frames.append((total, times))
+            self.count += 1
+            if self.writer:
+                self.writer.writerow(
+                    [self.count, total] + [times.get(stage, 0)
+                                           for stage in STAGES])
+            elif self.trace:
+                self.json_frames.append(dict(times, total=total))
+        self.current = {}
+        self.last_frame = now
+
+    def close(self):
+        """
+        Finishes the trace file
+        """
+        if self.trace_file:
+            self.trace_file.close()
+            self.trace_file = self.writer = None
+        elif self.trace and self.json_frames:
+            with open(self.trace, "w") as trace_file:
+                json.dump({'stages': STAGES, 'frames': self.json_frames},
+                          trace_file)
+            self.json_frames = []
+
+    def means(self):
+        """
+        The mean time of each stage, and of the whole frame, over the
+        frames kept
+        """
+        count = float(len(self.frames)) or 1
+        means = dict((stage, sum(times.get(stage, 0)
+                                 for _, times in self.frames) / count)
+                     for stage in STAGES)
+        return means, sum(total for total, _ in self.frames) / count
+
+    def draw(self, surface):
+        """
+        Draws the overlay in the bottom left corner of the surface,
+        returning the rect it covers
+        """
+        width, height = self.size
+        rect = pygame.Rect(0, surface.get_height() - height, width, height)
+        surface.fill((0, 0, 0), rect)
+
+        # The frame time graph, a column per frame
+        graph = pygame.Rect(rect.left + 5, rect.top + 5, width - 10, 60)
+        scale = graph.height / GRAPH_MAX
+        step = graph.width / float(self.frames.maxlen)
+        for i, (total, _) in enumerate(self.frames):
+            bar = min(int(total * scale), graph.height)
+            color = (90, 200, 90) if total <= BUDGET else (230, 90, 90)
+            x = graph.left + int(i * step)
+            draw.line(surface, color, (x, graph.bottom),
+                      (x, graph.bottom - bar))
+        y = graph.bottom - int(BUDGET * scale)
+        draw.line(surface, (200, 200, 200), (graph.left, y),
+                  (graph.right, y))
+
+        if self.font is None:
+            self.font = font.Font(None, 16)
+        if not self.labels or self.count % REFRESH == 0:
+            self.render_labels()
+
+        # A bar per stage of its mean time
+        means, _ = self.means()
+        y = graph.bottom + 6
+        for stage, color, label in zip(STAGES, STAGE_COLORS,
+                                       self.labels[1:]):
+            surface.blit(label, (rect.left + 5, y))
+            length = min(int(means[stage] / BUDGET * (width - 130)),
+                         width - 130)
+            surface.fill(color, (rect.left + 125, y + 2, max(length, 1), 7))
+            y += 12
+        surface.blit(self.labels[0], (rect.left + 5, y))
+        return rect
+
+    def render_labels(self):
+        means, total = self.means()
+        text = "frame {0:.2f}ms, {1:.0f} fps".format(
+            total * 1000, 1 / total if total else 0)
+        self.labels = [self.font.render(text, True, (255, 255, 255))]
+        for stage in STAGES:
+            text = "{0} {1:.2f}ms".format(stage, means[stage] * 1000)
+            self.labels.append(self.font.render(text, True,
+                                                (255, 255, 255)))
@@ -0,0 +1,167 @@
+"""
+Recording games as replays and checking their scores by playing them again.
+
+A replay is the level's seed, the time delta of every update and the inputs
+made between updates. As games are deterministic that is enough to play
+them again with sim and check the claimed score, which is what
+`python replay.py FILE_OR_DIR...` does, on every core.
+"""
+import multiprocessing, os, struct, sys, zlib
+
+import sim
+
+MAGIC = "MERP"
+# Bumped whenever the rules change, as older replays would not score the same
+VERSION = 2
+DIFFICULTIES = ("easy", "medium", "hard")
+
+# Input kinds
+DEV = 0
+COLOR = 1
+
+HEADER = struct.Struct("<4sBBQdII")
+DELTA = struct.Struct("<Id")
+INPUT = struct.Struct("<IBb")
+
+class Replay():
+    """
+    Set as a Game's recorder, records the game as it is played.
+
+    Time deltas are stored run length encoded as [count, delta] pairs, and
+    inputs as (step, kind, value) where step is the number of updates made
+    before the input.
+    """
+    def __init__(self, difficulty, seed, score=0, deltas=None, inputs=None):
+        self.difficulty = difficulty
+        self.seed = seed
+        self.score = score
+        self.deltas = deltas or []
+        self.inputs = inputs or []
+        self.steps = sum(count for count, _ in self.deltas)
+
+    def step(self, t_delta):
+        if self.deltas and self.deltas[-1][1] == t_delta:
+            self.deltas[-1][0] += 1
+        else:
+            self.deltas.append([1, t_delta])
+        self.steps += 1
+
+    def change_dev(self, change):
+        self.inputs.append((self.steps, DEV, change))
+
+    def change_color(self, index):
+        self.inputs.append((self.steps, COLOR, index))
+
+    def dumps(self):
+        body = "".join([DELTA.pack(*delta) for delta in self.deltas] +
+                       [INPUT.pack(*event) for event in self.inputs])
+        return HEADER.pack(MAGIC, VERSION,
+                           DIFFICULTIES.index(self.difficulty), self.seed,
+                           self.score, len(self.deltas), len(self.inputs)) + \
+            zlib.compress(body)
+
+    @classmethod
+    def loads(cls, data):
+        magic, version, difficulty, seed, score, deltas, inputs = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a version {0} replay".format(VERSION))
+        if difficulty >= len(DIFFICULTIES):
+            raise ValueError("Unknown difficulty {0}".format(difficulty))
+        body = zlib.decompress(data[HEADER.size:])
+        split = deltas * DELTA.size
+        return cls(DIFFICULTIES[difficulty], seed, score,
+                   [list(DELTA.unpack_from(body, i))
+                    for i in xrange(0, split, DELTA.size)],
+                   [INPUT.unpack_from(body, i)
+                    for i in xrange(split, len(body), INPUT.size)])
+
+    def save(self, filename):
+        with open(filename, "wb") as replay_file:
+            replay_file.write(self.dumps())
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as replay_file:
+            return cls.loads(replay_file.read())
+
+def simulate(replay):
+    """
+    Plays the replay again, returning the finished game. Raises ValueError
+    if the replay holds anything the game could not have recorded: updates
+    other than sim.STEP or after the game ended, changes of more than one
+    deviation or unknown colours.
+    """
+    if replay.difficulty not in DIFFICULTIES:
+        raise ValueError("Unknown difficulty {0}".format(replay.difficulty))
+    game = sim.Game(replay.difficulty, replay.seed)
+    game.create_level()
+    inputs = list(reversed(replay.inputs))
+    step = 0
+    for count, t_delta in replay.deltas:
+        if t_delta != sim.STEP:
+            raise ValueError("Update of {0}s, not a step".format(t_delta))
+        for _ in xrange(count):
+            if not game.running:
+                raise ValueError("Update after the game ended")
+            while inputs and inputs[-1][0] <= step:
+                _, kind, value = inputs.pop()
+                if kind == DEV and value in (-1, 1):
+                    game.change_dev(value)
+                elif kind == COLOR and 0 <= value < len(game.colors):
+                    game.change_color(value)
+                else:
+                    raise ValueError("Impossible input {0} {1}".format(
+                            kind, value))
+            game.update(t_delta)
+            step += 1
+    return game
+
+def verify(filename):
+    """
+    Checks the score claimed by a replay file. Returns the filename, whether
+    the score matched and the claimed and simulated scores.
+    """
+    try:
+        replay = Replay.load(filename)
+        score = simulate(replay).score
+    except Exception:
+        # Whatever is wrong with one replay, the rest are still verified
+        return filename, False, None, None
+    matches = abs(score - replay.score) <= 1e-6 * max(1, abs(score))
+    return filename, matches, replay.score, score
+
+def verify_many(filenames, processes=None):
+    """
+    Verifies the replay files in a pool of processes, one per core unless
+    told otherwise, yielding the results of verify as they come in.
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(verify, filenames, chunksize=4):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+def main(args):
+    filenames = []
+    for arg in args:
+        if os.path.isdir(arg):
+            filenames.extend(os.path.join(arg, name)
+                             for name in sorted(os.listdir(arg)))
+        else:
+            filenames.append(arg)
+
+    failed = 0
+    for filename, matches, claimed, score in verify_many(filenames):
+        if not matches:
+            failed += 1
+            print "{0}: claimed {1}, played {2}".format(filename, claimed,
+                                                        score)
+    print "{0} of {1} replays verified".format(len(filenames) - failed,
+                                                len(filenames))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,534 @@
+"""
+The rules of the game, without any drawing, sound or input handling.
+
+A Game is stepped with whatever time deltas it is given and its level is
+generated from its own seeded random number generator, so the same seed and
+deltas always play out the same way. Nothing here needs pygame, so games
+can be simulated headless, e.g. to gather statistics about levels, tune the
+difficulties or check scores.
+"""
+from math import pi
+from bisect import bisect_left, bisect_right
+import argparse, array, random, sys, time
+
+TURNS = 10
+# The time delta the game is updated with when played, so the only one a
+# replay may contain
+STEP = 1. / 120
+
+path_counts = {
+    'easy': 100,
+    'medium': 500,
+    'hard': 1000
+}
+
+avatar_speeds = {
+    'easy': 150,
+    'medium': 200,
+    'hard': 300
+}
+
+def randrange(start, end, rng=random):
+    """
+    Return a random variable between start and end. Will be a float
+
+    Arguments:
+    - `start`:
+    - `end`:
+    - `rng`: the random number generator to draw from
+    """
+    return rng.randrange(int(start*10000), int(end*10000))/10000.
+
+class Game():
+    bonus_decay = 0.7
+    bonus_increase = 10
+    color_difficulties = {
+        'easy': ['blue', 'red'],
+        'medium': ['blue', 'red', 'green'],
+        'hard': ['blue', 'red', 'green', 'yellow']
+        }
+
+    def __init__(self, difficulty, seed=None):
+        self.difficulty = difficulty
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.current_color = "blue"
+        self.running = True
+        self.bonus = 0
+        self.score = 0
+        self.level = None
+        self.avatar = None
+        # Told about every update and input, see replay.Replay
+        self.recorder = None
+
+    def create_level(self, path_count=None, density=None):
+        """
+        Generates the level and puts an avatar at its start. path_count and
+        density are passed on to the Level, see Level.generate_paths.
+        """
+        self.level = Level(self.difficulty, self.seed,
+                           path_count=path_count, density=density)
+        self.level.generate_paths()
+        self.avatar = Avatar(self, self.level)
+
+    def update(self, t_delta):
+        """
+        Moves the game on by t_delta seconds. Namely:
+         - Bonus decay
+         - Moving the avatar
+         - Hitting points
+
+        """
+        if self.recorder:
+            self.recorder.step(t_delta)
+        if not self.avatar.on_path():
+            self.bonus -= self.bonus_decay * self.bonus * t_delta
+            if self.bonus < 1:
+                self.bonus = 0
+        else:
+            self.bonus += self.bonus_increase * t_delta
+
+        oldt = self.avatar.t
+
+        self.avatar.update(t_delta)
+
+        # Every path the step went over, not just the one it ended on, in
+        # the order they were passed
+        paths = self.level.path_index[self.avatar.dev].between(
+            min(oldt, self.avatar.t), max(oldt, self.avatar.t))
+        if self.avatar.t < oldt:
+            paths.reverse()
+        crossed = [point for path in paths
+                   for point in path.passed(oldt, self.avatar.t)]
+        for point in crossed:
+            self.point_passed(point)
+            if self.correct_point(point):
+                self.correct_point_hit()
+            elif not self.avatar.bouncing:
+                self.incorrect_point_hit()
+                # The avatar bounced back before reaching the rest
+                break
+
+    def point_passed(self, point):
+        if not point.unhittable:
+            point.hit = True
+
+    def correct_point(self, point):
+        return point.color == self.current_color
+
+    @property
+    def colors(self):
+        return self.color_difficulties[self.difficulty]
+
+    def change_color(self, index):
+        if self.recorder:
+            self.recorder.change_color(index)
+        self.current_color = self.colors[index]
+
+    def change_dev(self, change):
+        if self.recorder:
+            self.recorder.change_dev(change)
+        self.avatar.change_dev(change)
+
+    def correct_point_hit(self):
+        self.score += self.bonus * 1000
+        self.bonus += 10
+
+        self.avatar.correct_point_hit()
+
+    def incorrect_point_hit(self):
+        self.score /= 5
+        self.bonus = 0
+
+        self.avatar.incorrect_point_hit()
+
+class Level():
+    """
+    The layout of a level: the paths along each deviation of the spiral and
+    the points on them, in polar coordinates.
+    """
+    def __init__(self, difficulty, seed=None,
+                 sample_interval=10, const=30,
+                 init=1.0, max=2*pi*TURNS,
+                 path_count=None, density=None):
+        self.difficulty = difficulty
+        self.colors = Game.color_difficulties[difficulty]
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.path_count = path_count or path_counts[difficulty]
+        self.density = density
+
+        self.interval = sample_interval
+        self.const = const
+        self.init = init
+        self.max = max
+        self.paths_by_color = {}
+        for color in self.colors:
+            self.paths_by_color[color] = []
+        self.paths_by_dev = {-2: [], -1: [], 0: [], 1: [], 2: []}
+        self.path_index = {}
+        self.index_paths()
+        self.points = Points()
+
+    def generate_paths(self):
+        """
+        Scatters path_count paths over the spiral, dropping any that would
+        overlap one already placed. If a density was given the spiral is
+        filled to it instead, see fill_paths.
+        """
+        if self.density:
+            return self.fill_paths(self.path_count, self.density)
+
+        rng = self.random
+        for _ in range(self.path_count):
+            color = rng.choice(self.colors)
+            dev = rng.randrange(-2, 3)
+            s = randrange(self.init + pi, self.max - pi/8, rng)
+            l = randrange(pi/8, pi/4, rng)
+            e = s + l
+            if e > self.max:
+                e = self.max
+            if self.path_index[dev].overlaps(s, e):
+                continue
+
+            self.add_path(Path(self, s, e, color, dev))
+
+    def fill_paths(self, count, density):
+        """
+        Places `count` paths, spread evenly over the deviations, so that
+        they cover `density` of each deviation. Rather than rejecting
+        overlapping paths, the covered and free lengths of each deviation
+        are shared out randomly between the paths and the gaps around them.
+        """
+        rng = self.random
+        start, end = self.init + pi, self.max
+        devs = sorted(self.paths_by_dev)
+        for i, dev in enumerate(devs):
+            n = count / len(devs) + (i < count % len(devs))
+            if not n:
+                continue
+            lengths = [randrange(1, 2, rng) for _ in xrange(n)]
+            gaps = [rng.random() for _ in xrange(n + 1)]
+            length_scale = (end - start) * density / sum(lengths)
+            gap_scale = (end - start) * (1 - density) / sum(gaps)
+            t = start
+            for length, gap in zip(lengths, gaps):
+                s = t + gap * gap_scale
+                t = s + length * length_scale
+                color = rng.choice(self.colors)
+                self.add_path(Path(self, s, min(t, end), color, dev))
+
+    def add_path(self, path):
+        path.generate_points(1 + self.random.random() * 5, self.random)
+        self.insert_path(path)
+
+    def insert_path(self, path):
+        """
+        Adds a path whose points have already been placed
+        """
+        self.paths_by_color[path.color].append(path)
+        self.paths_by_dev[path.dev].append(path)
+        self.path_index[path.dev].insert(path)
+
+    def index_paths(self):
+        for dev, paths in self.paths_by_dev.items():
+            self.path_index[dev] = PathIndex(paths)
+
+    def path_at(self, t, dev):
+        """
+        The path covering t on the given deviation, or None
+        """
+        return self.path_index[dev].find(t)
+
+    def radius(self, t, dev=0):
+        return self.const * (t + dev * pi/float(4))
+
+class PathIndex():
+    """
+    The paths on a single deviation, sorted by start. Paths never overlap,
+    so the one covering a given t can be found by bisecting the starts. The
+    last lookup is remembered, as the avatar is nearly always still on the
+    same path or has just moved on to the next one.
+    """
+    def __init__(self, paths=()):
+        self.paths = sorted(paths, key=lambda path: path.start)
+        self.starts = [path.start for path in self.paths]
+        self.cursor = 0
+
+    def find(self, t):
+        paths = self.paths
+        for i in (self.cursor, self.cursor + 1):
+            if i < len(paths) and paths[i].start < t < paths[i].end:
+                self.cursor = i
+                return paths[i]
+
+        i = bisect_right(self.starts, t) - 1
+        self.cursor = max(i, 0)
+        if i >= 0 and t < paths[i].end and paths[i].start < t:
+            return paths[i]
+        return None
+
+    def overlaps(self, start, end):
+        """
+        Whether any path overlaps the open interval (start, end). Only the
+        last path starting before `end` can, as the paths before it end
+        before it starts.
+        """
+        i = bisect_left(self.starts, end)
+        return i > 0 and self.paths[i - 1].end > start
+
+    def between(self, start, end):
+        """
+        The paths overlapping [start, end], in order. Of the paths starting
+        before `start`, only the last can reach it.
+        """
+        first = max(bisect_right(self.starts, start) - 1, 0)
+        last = bisect_right(self.starts, end)
+        return [path for path in self.paths[first:last] if path.end >= start]
+
+    def insert(self, path):
+        i = bisect_right(self.starts, path.start)
+        self.starts.insert(i, path.start)
+        self.paths.insert(i, path)
+
+class Avatar():
+    def __init__(self, game, level):
+        self.game = game
+        self.level = level
+        self.t = level.init
+        self.last_t = self.t
+        self.speed = avatar_speeds[game.difficulty]
+        self.dev = 0
+        self.bouncing = False
+
+    @property
+    def polar(self):
+        """
+        The polar coords of the avatar. (r, theta)
+        """
+        return self.level.radius(self.t, self.dev), self.t
+
+    def change_dev(self, change):
+        if -3 < self.dev + change < 3:
+            self.dev += change
+
+    def update(self, t_delta):
+        self.last_t = self.t
+        d_delta = self.speed * t_delta
+        self.t += d_delta / self.level.radius(self.t)
+        if not (self.level.init < self.t < self.level.max):
+            self.game.running = False
+
+        if self.bouncing:
+            if self.speed < self.pre_speed:
+                self.speed += 10
+            else:
+                self.bouncing = False
+
+    def correct_point_hit(self):
+        self.speed += 3
+
+    def incorrect_point_hit(self):
+        self.bouncing = True
+        self.pre_speed = self.speed
+        self.speed *= -1
+        self.speed += 5
+
+    def on_path(self):
+        path = self.get_on_path()
+        return path is not None and path.color == self.game.current_color
+
+    def on_any_path(self):
+        return self.get_on_path() is not None
+
+    def get_on_path(self):
+        return self.level.path_at(self.t, self.dev)
+
+class Points():
+    """
+    The points of a level, stored a column per attribute rather than as an
+    object each. A path's points are added together, so they take up a
+    slice of the columns, in order of t.
+    """
+    HIT = 1
+    UNHITTABLE = 2
+
+    def __init__(self):
+        self.t = array.array("d")
+        self.r = array.array("d")
+        self.dev = array.array("b")
+        # The index of the point's path's colour in the level's colours
+        self.color = array.array("B")
+        self.flags = array.array("B")
+
+    def __len__(self):
+        return len(self.t)
+
+    def append(self, t, r, dev, color, unhittable=False):
+        self.t.append(t)
+        self.r.append(r)
+        self.dev.append(dev)
+        self.color.append(color)
+        self.flags.append(self.UNHITTABLE if unhittable else 0)
+
+class Path():
+    def __init__(self, level,
+                 start, end, color, dev):
+        self.start = start
+        self.end = end
+        self.color = color
+        self.dev = dev
+        self.level = level
+        # The slice of the level's points on this path
+        self.first = self.last = len(level.points)
+
+    def add_point(self, t, unhittable=False):
+        """
+        Adds a point at t, after any already on the path
+        """
+        points = self.level.points
+        assert self.last == len(points), "points added out of order"
+        points.append(t, self.level.radius(t, self.dev), self.dev,
+                      self.level.colors.index(self.color), unhittable)
+        self.last += 1
+
+    def generate_points(self, count, rng=random):
+        length = self.end - self.start
+        s_offset = rng.random() * length / 3.
+        e_offset = rng.random() * length / 3.
+        t = self.start + s_offset
+        d = ((self.end - e_offset) - (self.start - s_offset))/float(count)
+        while t < self.end:
+            unhittable = int(rng.random() * 100) == 0
+            self.add_point(t, unhittable)
+            t += d
+
+    def passed(self, start, end):
+        """
+        The points not hit yet that were crossed moving from start to end,
+        in the order they were crossed. Moving forwards that is the points
+        in (start, end], and backwards the ones in [end, start).
+        """
+        t, flags = self.level.points.t, self.level.points.flags
+        if start <= end:
+            indices = xrange(bisect_right(t, start, self.first, self.last),
+                             bisect_right(t, end, self.first, self.last))
+        else:
+            indices = xrange(bisect_left(t, start, self.first, self.last) - 1,
+                             bisect_left(t, end, self.first, self.last) - 1,
+                             -1)
+        return [Point(self, i) for i in indices
+                if not flags[i] & Points.HIT]
+
+class Point(object):
+    """
+    A view of one of a level's points, see Points
+    """
+    __slots__ = ("path", "index")
+
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, Point) and self.index == other.index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self.index
+
+    @property
+    def t(self):
+        return self.path.level.points.t[self.index]
+
+    @property
+    def r(self):
+        return self.path.level.points.r[self.index]
+
+    @property
+    def dev(self):
+        return self.path.dev
+
+    @property
+    def unhittable(self):
+        return bool(self.path.level.points.flags[self.index] &
+                    Points.UNHITTABLE)
+
+    @property
+    def color(self):
+        return "grey" if self.unhittable else self.path.color
+
+    @property
+    def hit(self):
+        return bool(self.path.level.points.flags[self.index] & Points.HIT)
+
+    @hit.setter
+    def hit(self, value):
+        flags = self.path.level.points.flags
+        if value:
+            flags[self.index] |= Points.HIT
+        else:
+            flags[self.index] &= ~Points.HIT
+
+def autopilot(game):
+    """
+    A policy that switches to the colour of whatever path the avatar is on
+    """
+    path = game.avatar.get_on_path()
+    if path is not None and path.color != game.current_color:
+        game.change_color(game.colors.index(path.color))
+
+def play(difficulty, seed, t_delta=1/60., policy=autopilot,
+         path_count=None, density=None):
+    """
+    Plays a whole game in steps of t_delta, letting `policy(game)` make its
+    moves before each step. Returns the finished game and the number of
+    steps taken.
+    """
+    game = Game(difficulty, seed)
+    game.create_level(path_count, density)
+    steps = 0
+    while game.running:
+        if policy:
+            policy(game)
+        game.update(t_delta)
+        steps += 1
+    return game, steps
+
+def main(args):
+    """
+    Plays the given number of games of each difficulty and prints how they
+    went. --paths and --density generate bigger or denser levels than the
+    difficulties do, to stress test the game.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("games", nargs="?", type=int, default=10)
+    parser.add_argument("-p", "--paths", type=int,
+                        help="paths per level instead of the difficulty's")
+    parser.add_argument("-d", "--density", type=float,
+                        help="fraction of each deviation to cover with "
+                        "paths, see Level.fill_paths")
+    args = parser.parse_args(args)
+
+    for difficulty in sorted(path_counts):
+        start = time.time()
+        scores = []
+        paths = 0
+        for seed in xrange(args.games):
+            game, steps = play(difficulty, seed, path_count=args.paths,
+                               density=args.density)
+            scores.append(game.score)
+            paths += sum(len(dev_paths) for dev_paths
+                         in game.level.paths_by_dev.values())
+        taken = time.time() - start
+        print "{0}: {1} games of {2} paths in {3:.2f}s, mean score {4:.0f}, " \
+            "best {5:.0f}".format(difficulty, args.games, paths / args.games,
+                                  taken, sum(scores) / len(scores),
+                                  max(scores))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))